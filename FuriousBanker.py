@@ -12,52 +12,206 @@
 # either express or implied. See the License for the specific language governing permissions and
 # limitations under the License.
 
+import getpass
+import os
+import threading
+import time
 import webbrowser
 
+import startup  # first, so that the startup profile includes the imports below
+
 from kivy.app import App
-from kivy.clock import Clock
-from kivy.properties import NumericProperty
+from kivy.clock import Clock, mainthread
+from kivy.core.window import Window
+from kivy.graphics import Color, Line
+from kivy.logger import Logger
+from kivy.properties import ListProperty, NumericProperty, StringProperty
 from kivy.uix.accordion import Accordion, AccordionItem
 from kivy.uix.boxlayout import BoxLayout
 from kivy.uix.button import Button
 from kivy.uix.image import Image
 from kivy.uix.label import Label
 from kivy.uix.popup import Popup
+from kivy.uix.recycleview import RecycleView
+from kivy.uix.recycleview.views import RecycleDataViewBehavior
 from kivy.uix.togglebutton import ToggleButton
-from ruamel.yaml import YAML
-
-import calculator
+from kivy.uix.widget import Widget
 
+import numpy as np
 
-class AppConfig:
+import appconfig
+import assets
+import calculator
+import gameclock
+import history
+import instrument
+import loansource
+import timeseries
+from environment import REJECT
 
-    def __init__(self):
-        self.new_loan_limit = None
-        self.profitability = None
-        self.concentration = None
-        self.profitability_p = None
-        self.concentration_p = None
-        self.portfolio_size = None
-        self.duration = None
-        self.time_delta = None
-        self.winning_score = None
+startup.mark('imports')
 
 
 class FuriousBankerApp(App):
     __version__ = '0.3'
 
     def build(self):
+        startup.mark('kv')
         self.icon = 'data/FuriousBankerA1.png'
-        root = Root()
+        config = appconfig.load_config('configuration.yml')
+        startup.mark('config')
+        if instrument.ENABLED:
+            instrument.count_calls(calculator)
+        root = Root(config)
+        startup.mark('build')
         return root
 
+    def on_start(self):
+        if startup.PROFILE:
+            Window.bind(on_flip=self.first_frame)
+        if instrument.ENABLED:
+            Clock.schedule_interval(self.frame_time, 0)
+            Clock.schedule_interval(self.count_widgets, 1.0)
+            if instrument.PORT:
+                instrument.serve(instrument.PORT)
+        # decode the images in the background and build the popups after the
+        # first frames, so that opening a popup later only updates it
+        assets.preload(self.assets_loaded)
+        Clock.schedule_once(self.root.build_popups, 1)
+
+    def assets_loaded(self, ms):
+        instrument.observe('assets_preload', ms)
+        if startup.PROFILE or instrument.ENABLED:
+            Logger.info('Startup: {} images preloaded in {:.1f} ms'.format(len(assets.IMAGES), ms))
+
+    # report the startup profile once the first frame is on screen
+    def first_frame(self, *args):
+        Window.unbind(on_flip=self.first_frame)
+        startup.mark('first frame')
+        startup.report(Logger.info)
+
+    # instrumentation: time between frames and size of the widget tree
+    def frame_time(self, dt):
+        instrument.observe('frame', 1000 * dt)
+
+    def count_widgets(self, dt):
+        instrument.gauges['widgets'] = sum(1 for _ in self.root.walk())
+        instrument.gauges['portfolio_views'] = len(self.root.slayout.layout_manager.children)
+
+    # the time display is not refreshed while the app is paused (mobile)
+    def on_pause(self):
+        self.root.pause_time_refresh()
+        return True
+
+    def on_resume(self):
+        self.root.resume_time_refresh()
+
+    # write out the sessions still queued for the session store
+    def on_stop(self):
+        if self.root.session_store is not None:
+            self.root.session_store.close()
+
+
+# one exposure bar of the portfolio view, the widgets are recycled so the
+# selection state lives in the view data rather than in a ToggleButton group
+class LoanBar(RecycleDataViewBehavior, ToggleButton):
+    ID = StringProperty('0')
+    view = None
+
+    def refresh_view_attrs(self, rv, index, data):
+        self.view = rv
+        return super(LoanBar, self).refresh_view_attrs(rv, index, data)
+
+    def on_press(self):
+        self.view.select(int(self.ID))
+        self.view.dispatch('on_select', self)
+
+
+# virtualized list of the portfolio exposures: bar widgets exist only for the
+# visible loans and a single loan change refreshes only that bar
+class PortfolioView(RecycleView):
+    selected = NumericProperty(0)
+
+    def __init__(self, **kwargs):
+        self.register_event_type('on_select')
+        super(PortfolioView, self).__init__(**kwargs)
+
+    def bar(self, i, exp):
+        return {'ID': str(i), 'text': str(i + 1), 'size_hint': (float(exp), None),
+                'state': 'down' if i == self.selected else 'normal'}
+
+    # show a whole portfolio
+    def show(self, portfolio, selected_id):
+        self.selected = selected_id
+        self.data = [self.bar(i, exp) for i, exp in enumerate(portfolio.exp)]
+
+    # refresh the bar of one loan
+    def update(self, i, exp):
+        self.set_bar(i, size_hint=(float(exp), None))
+
+    def select(self, i):
+        previous, self.selected = self.selected, i
+        if previous != i and previous < len(self.data):
+            self.set_bar(previous, state='normal')
+        self.set_bar(i, state='down')
+
+    # assigning to data would relayout every bar, so the data item is changed in
+    # place and only a visible bar widget is updated
+    def set_bar(self, i, **attrs):
+        self.data[i].update(attrs)
+        bar = self.view_adapter.get_visible_view(i)
+        if bar is not None:
+            for key, value in attrs.items():
+                setattr(bar, key, value)
+
+    def on_select(self, bar):
+        pass
+
+
+# live trend of one metric over the session time, the history is min / max
+# downsampled to two points per two pixels of width, so a redraw costs the same
+# however long the session runs
+class TrendChart(Widget):
+    metric = StringProperty('score')
+    color = ListProperty([0.31, 0.27, 0.52, 1])
+
+    def __init__(self, **kwargs):
+        super(TrendChart, self).__init__(**kwargs)
+        self.history = None
+        self.duration = 1
+        with self.canvas:
+            self.line_color = Color(*self.color)
+            self.line = Line(width=1.2)
+        self.bind(pos=self.redraw, size=self.redraw, color=self.on_color)
+
+    def on_color(self, instance, value):
+        self.line_color.rgba = value
+
+    def plot(self, history, duration):
+        self.history = history
+        self.duration = duration or 1
+        self.redraw()
+
+    def redraw(self, *args):
+        if self.history is None:
+            return
+        t = self.history.column('time')
+        y = self.history.column(self.metric)
+        finite = np.isfinite(y)
+        t, y = timeseries.minmax(t[finite], y[finite], max(1, int(self.width // 2)))
+        if y.size == 0:
+            self.line.points = []
+            return
+        low, high = float(y.min()), float(y.max())
+        x = self.x + self.width * np.clip(t / self.duration, 0, 1)
+        y = self.y + 2 + (self.height - 4) * ((y - low) / (high - low) if high > low else np.full(y.size, 0.5))
+        self.line.points = np.column_stack([x, y]).ravel().tolist()
+
 
 # define the main widget as a BoxLayout
 class Root(BoxLayout):
-    in_yaml = YAML(typ='unsafe')
-    inFile = open('configuration.yml', 'r')
-    AC = in_yaml.load(inFile)
-    inFile.close()
+    # game parameters (configuration.yml), set at instantiation
+    AC = None
 
     # initialize new loan properties
     new_loan_el = NumericProperty()
@@ -65,7 +219,7 @@ class Root(BoxLayout):
     new_loan_exp = NumericProperty()
 
     new_loan_count = NumericProperty(0)
-    new_loan_limit = NumericProperty(AC.new_loan_limit)
+    new_loan_limit = NumericProperty(0)
 
     # initialize selected loan properties
     selected_loan_id = NumericProperty()
@@ -74,13 +228,16 @@ class Root(BoxLayout):
     selected_loan_exp = NumericProperty()
 
     # initialize metrics (current values and previous)
-    profitability = NumericProperty(AC.profitability)
-    concentration = NumericProperty(AC.concentration)
+    profitability = NumericProperty(0)
+    concentration = NumericProperty(0)
     score = NumericProperty(0)
     exposures = NumericProperty(0)
+    # optional simulated credit VaR (% of exposure), loss_scenarios > 0 enables it
+    credit_var = NumericProperty(0)
+    loss_scenarios = NumericProperty(0)
 
-    profitability_p = NumericProperty(AC.profitability_p)
-    concentration_p = NumericProperty(AC.concentration_p)
+    profitability_p = NumericProperty(0)
+    concentration_p = NumericProperty(0)
     score_p = NumericProperty(0)
     exposures_p = NumericProperty(0)
 
@@ -98,40 +255,147 @@ class Root(BoxLayout):
     profitability_b = NumericProperty(1)
 
     # initialize loan portfolio
-    portfolio_size = AC.portfolio_size
+    portfolio_size = None
     portfolio = {}
+    metrics = None
+    loan_source = None
+    # the session as offered: initial portfolio and proposals, for the solver
+    initial_portfolio = None
+    session_loans = None
+    # optional binary log of the game events
+    event_log = None
+    # optional store of the finished sessions and the metrics after every step
+    session_store = None
+    player = None
+    # optional loan book (loanbook.BookMetrics) the portfolio is taken from
+    loan_book = None
+    trajectory = None
+    accepted_count = 0
+    # versions of the portfolio after every decision, for undo / redo
+    history = None
+    # the metrics at every decision and clock tick, for the trend charts
+    metric_history = None
+    # optional defaults, amortization and spread moves over the game time
+    dynamics = None
 
     # time keeping goodies
     # game duration (300)
-    duration = AC.duration
-    time_delta = AC.time_delta
+    duration = None
+    # fastest and slowest refresh of the remaining time display
+    time_delta = None
+    time_delta_max = None
     time = NumericProperty(0)
-
-    winning_score = AC.winning_score
-
-    def increment_time(self, dt):
-        self.time += dt
+    game_clock = None
+    time_event = None
+
+    winning_score = None
+
+    # refresh the displayed time from the game clock
+    def refresh_time(self, dt=None):
+        self.time = self.game_clock.elapsed()
+        if self.metrics is None:
+            return
+        if self.dynamics is not None and self.dynamics.advance(self.time, self.AC.dynamics_period):
+            self.market_moved()
+        else:
+            self.record_metrics()
 
     def time_reset(self):
+        self.game_clock.start()
         self.time = 0
 
+    # refresh the time display about once per pixel of progress bar movement
+    def schedule_time_refresh(self, *args):
+        self.pause_time_refresh()
+        interval = self.game_clock.refresh_interval(self.ids.time_bar.width, self.time_delta, self.time_delta_max)
+        self.time_event = Clock.schedule_interval(self.refresh_time, interval)
+
+    # stop refreshing the time display while it is not visible
+    def pause_time_refresh(self, *args):
+        if self.time_event is not None:
+            self.time_event.cancel()
+            self.time_event = None
+
+    def resume_time_refresh(self, *args):
+        self.refresh_time()
+        self.schedule_time_refresh()
+
     # instantiation of the root widget
-    def __init__(self, **kwargs):
+    def __init__(self, config=None, **kwargs):
         # print('init')
+        self.AC = appconfig.load_config() if config is None else config
+        self.new_loan_limit = self.AC.new_loan_limit
+        self.profitability = self.AC.profitability
+        self.concentration = self.AC.concentration
+        self.profitability_p = self.AC.profitability_p
+        self.concentration_p = self.AC.concentration_p
+        self.portfolio_size = self.AC.portfolio_size
+        self.duration = self.AC.duration
+        self.time_delta = self.AC.time_delta
+        self.time_delta_max = self.AC.time_delta_max
+        self.winning_score = self.AC.winning_score
+        self.loss_scenarios = self.AC.loss_scenarios or 0
+        if self.AC.event_log:
+            import eventlog
+
+            # the log records decisions only, replays of it would miss the period moves
+            if self.AC.dynamics_period:
+                raise ValueError('dynamics_period cannot be used together with event_log')
+            self.event_log = eventlog.EventLog(self.AC.event_log)
+        if self.AC.session_store:
+            import sqlite3
+
+            import store
+
+            # the game runs without a store if the database cannot be opened
+            try:
+                self.session_store = store.SessionStore(self.AC.session_store, log=Logger.warning)
+            except sqlite3.Error as e:
+                Logger.warning('Store: sessions are not saved, {} cannot be opened: {}'.format(
+                    self.AC.session_store, e))
+        self.player = self.AC.player or getpass.getuser()
+        self.metric_history = timeseries.MetricHistory()
+        # the popups, built once on first use (or by build_popups) and reused
+        self.popups = {}
+        if self.AC.loan_book:
+            import loanbook
+
+            self.loan_book = loanbook.summarize(self.AC.loan_book, top=self.portfolio_size)
         super(Root, self).__init__(**kwargs)
 
-        Clock.schedule_interval(self.increment_time, self.time_delta)
+        self.game_clock = gameclock.GameClock(self.duration)
+        self.schedule_time_refresh()
+        self.ids.time_bar.bind(width=self.schedule_time_refresh)
+        Window.bind(on_minimize=self.pause_time_refresh, on_hide=self.pause_time_refresh,
+                    on_restore=self.resume_time_refresh, on_show=self.resume_time_refresh)
         Clock.schedule_once(self.show_gameover, self.duration)
 
-        # initialize a portfolio
-        size = self.portfolio_size
-        self.portfolio = calculator.init(size)
+        # initialize a portfolio and the new loan stream of the session
+        self.session_seeder = loansource.SessionSeeder(self.AC.seed)
+        rng, loan_rng = self.session_seeder.next()
+        self.portfolio, book_base = self.new_portfolio(rng)
+        self.initial_portfolio = self.portfolio.copy()
+        self.session_loans = []
+        if self.event_log is not None:
+            self.event_log.start(self.portfolio)
+        self.loan_source = loansource.RandomLoanSource(loan_rng, prefetch=True)
+        self.metrics = calculator.Metrics(self.portfolio, base=book_base)
+        self.history = history.PortfolioHistory(self.metrics)
+        self.dynamics = None
+        if self.AC.dynamics_period:
+            import dynamics
+
+            self.dynamics = dynamics.Dynamics(self.metrics, seed=rng)
         self.display_portfolio(0)
         # initialize portfolio metrics
-        self.profitability = calculator.profit(self.portfolio)
-        self.concentration = calculator.risky_hhi(self.portfolio)
-        self.score = calculator.score(self.portfolio)
-        self.exposures = calculator.exposure(self.portfolio)
+        self.profitability = self.metrics.profit
+        self.concentration = self.metrics.risky_hhi
+        self.score = self.metrics.score
+        self.exposures = self.metrics.exposure
+        self.update_credit_var()
+        self.trajectory = [self.step_metrics()]
+        self.metric_history.clear()
+        self.record_metrics()
 
         self.profitability_p = self.profitability
         self.concentration_p = self.concentration
@@ -140,36 +404,53 @@ class Root(BoxLayout):
         self.update_color()
 
         # initialize the new loan data
-        newloan = calculator.newloan()
-        self.display_newloan(newloan)
+        self.display_newloan(self.next_proposal())
 
         # initialize the selected loan data
         loan = self.portfolio[0]
         self.set_selected([loan['index'], loan['el'], loan['s'], loan['exp']])
 
     # execute this when user clicks the restart button
+    @instrument.timed('reset')
     def reset(self):
         # print('reset')
-        self.time = 0
-        size = self.portfolio_size
-        self.portfolio = calculator.init(size)
+        self.time_reset()
+        rng, loan_rng = self.session_seeder.next()
+        self.portfolio, book_base = self.new_portfolio(rng)
+        self.initial_portfolio = self.portfolio.copy()
+        self.session_loans = []
+        if self.event_log is not None:
+            self.event_log.start(self.portfolio)
+        self.loan_source.close()
+        self.loan_source = loansource.RandomLoanSource(loan_rng, prefetch=True)
+        self.metrics = calculator.Metrics(self.portfolio, base=book_base)
+        self.history = history.PortfolioHistory(self.metrics)
+        self.dynamics = None
+        if self.AC.dynamics_period:
+            import dynamics
+
+            self.dynamics = dynamics.Dynamics(self.metrics, seed=rng)
         self.display_portfolio(0)
         self.new_loan_count = 0
+        self.accepted_count = 0
 
-        newloan = calculator.newloan()
-        self.display_newloan(newloan)
+        self.display_newloan(self.next_proposal())
 
-        self.profitability = calculator.profit(self.portfolio)
+        self.profitability = self.metrics.profit
         self.profitability_p = self.profitability
 
-        self.concentration = calculator.risky_hhi(self.portfolio)
+        self.concentration = self.metrics.risky_hhi
         self.concentration_p = self.concentration
 
-        self.exposures = calculator.exposure(self.portfolio)
+        self.exposures = self.metrics.exposure
+        self.update_credit_var()
         self.exposures_p = self.exposures
 
-        self.score = calculator.score(self.portfolio)
+        self.score = self.metrics.score
         self.score_p = self.score
+        self.trajectory = [self.step_metrics()]
+        self.metric_history.clear()
+        self.record_metrics()
         self.update_color()
 
         loan = self.portfolio[0]
@@ -178,6 +459,18 @@ class Root(BoxLayout):
         Clock.unschedule(self.show_gameover)
         Clock.schedule_once(self.show_gameover, self.duration)
 
+    # a random portfolio, or the largest exposures of the configured loan book
+    # (scaled so the largest is at most the 1 bln loan size limit), with the
+    # running sums of the rest of the book scaled the same way (None without a
+    # loan book): the metrics are those of the whole book
+    def new_portfolio(self, rng):
+        if self.loan_book is None:
+            return calculator.init(self.portfolio_size, rng), None
+        portfolio = self.loan_book.portfolio()
+        divisor = max(1.0, float(portfolio.exp.max(initial=0.0)))
+        portfolio.exp /= divisor
+        return portfolio, self.loan_book.residual(1.0 / divisor)
+
     # execute this when the user wants to read the full documentation
     def web_docs(self):
         webbrowser.open_new("https://www.openriskmanagement.com/furiousbanker/")
@@ -191,6 +484,7 @@ class Root(BoxLayout):
         self.selected_loan_exp = selloan[3]
 
     # execute this when a different loan is selected
+    @instrument.timed('select_other')
     def select_other(self, instance):
         # print('test')
         loanid = self.portfolio[int(instance.ID)]['index']
@@ -209,44 +503,136 @@ class Root(BoxLayout):
         self.new_loan_s = newloan[1]
         self.new_loan_exp = newloan[2]
 
+    # the proposal of the current deal: the one offered before if the deal was
+    # undone, otherwise the next of the loan source
+    def next_proposal(self):
+        if self.new_loan_count < len(self.session_loans):
+            return self.session_loans[int(self.new_loan_count)]
+        newloan = self.loan_source.next()
+        self.session_loans.append(newloan)
+        return newloan
+
+    @instrument.timed('accept')
     def accept(self):
         if self.new_loan_count < self.new_loan_limit:
             self.new_loan_count += 1
+            self.accepted_count += 1
             # update and display portfolio
             loanid = int(self.selected_loan_id)
-            self.portfolio[loanid]['el'] = self.new_loan_el
-            self.portfolio[loanid]['s'] = self.new_loan_s
-            self.portfolio[loanid]['exp'] = self.new_loan_exp
-            self.display_portfolio(loanid)
+            if self.event_log is not None:
+                self.event_log.accept(loanid, (self.new_loan_el, self.new_loan_s, self.new_loan_exp))
+            self.history.commit(loanid, (self.new_loan_el, self.new_loan_s, self.new_loan_exp))
+            self.slayout.update(loanid, self.new_loan_exp)
             # update selected loan data
             self.selected_loan_el = self.new_loan_el
             self.selected_loan_s = self.new_loan_s
             self.selected_loan_exp = self.new_loan_exp
-            # update metrics
-            # store current values for comparison
-            self.profitability_p = self.profitability
-            self.concentration_p = self.concentration
-            self.score_p = self.score
-            self.exposures_p = self.exposures
-
-            self.profitability = calculator.profit(self.portfolio)
-            self.concentration = calculator.risky_hhi(self.portfolio)
-            self.score = calculator.score(self.portfolio)
-            self.exposures = calculator.exposure(self.portfolio)
-
-            self.update_color()
+            self.update_metrics()
+            self.trajectory.append(self.step_metrics())
 
             # initialize new loan data
-            newloan = calculator.newloan()
-            self.display_newloan(newloan)
+            self.display_newloan(self.next_proposal())
 
+    @instrument.timed('reject')
     def reject(self):
         # initialize new loan data
         if self.new_loan_count < self.new_loan_limit:
             self.new_loan_count += 1
-            newloan = calculator.newloan()
-            self.display_newloan(newloan)
+            if self.event_log is not None:
+                self.event_log.reject((self.new_loan_el, self.new_loan_s, self.new_loan_exp))
+            self.history.commit(REJECT, (self.new_loan_el, self.new_loan_s, self.new_loan_exp))
+            self.trajectory.append(self.step_metrics())
+            self.record_metrics()
+            self.display_newloan(self.next_proposal())
+
+    # show the portfolio after a period of the dynamics, decisions before it
+    # can no longer be undone
+    def market_moved(self):
+        self.history = history.PortfolioHistory(self.metrics)
+        selected = int(self.selected_loan_id)
+        self.display_portfolio(selected)
+        loan = self.portfolio[selected]
+        self.set_selected([loan['index'], loan['el'], loan['s'], loan['exp']])
+        self.update_metrics()
+
+    # take back the last decision, its proposal is offered again (not
+    # available with an event log, which is append only)
+    @instrument.timed('undo')
+    def undo(self):
+        if self.event_log is not None:
+            return
+        version = self.history.undo()
+        if version is None:
+            return
+        self.new_loan_count -= 1
+        if version.accepted:
+            self.accepted_count -= 1
+            self.slayout.update(version.slot, version.old[2])
+            self.select_slot(version.slot)
+        self.update_metrics()
+        self.trajectory.pop()
+        self.display_newloan(self.next_proposal())
+
+    # decide again as before the last undo
+    @instrument.timed('redo')
+    def redo(self):
+        if self.event_log is not None:
+            return
+        version = self.history.redo()
+        if version is None:
+            return
+        self.new_loan_count += 1
+        if version.accepted:
+            self.accepted_count += 1
+            self.slayout.update(version.slot, version.new[2])
+            self.select_slot(version.slot)
+        self.update_metrics()
+        self.trajectory.append(self.step_metrics())
+        self.display_newloan(self.next_proposal())
+
+    def select_slot(self, i):
+        loan = self.portfolio[i]
+        self.set_selected([loan['index'], loan['el'], loan['s'], loan['exp']])
+        self.slayout.select(i)
+
+    # show the metrics of the portfolio, the values they replace are kept for
+    # the comparison colors
+    def update_metrics(self):
+        self.profitability_p = self.profitability
+        self.concentration_p = self.concentration
+        self.score_p = self.score
+        self.exposures_p = self.exposures
 
+        self.profitability = self.metrics.profit
+        self.concentration = self.metrics.risky_hhi
+        self.score = self.metrics.score
+        self.exposures = self.metrics.exposure
+        self.update_credit_var()
+        self.update_color()
+        self.record_metrics()
+
+    # add the current metrics to the history and redraw the trend charts
+    def record_metrics(self):
+        self.metric_history.append(self.game_clock.elapsed(), self.new_loan_count, self.score, self.profitability,
+                                   self.concentration, self.exposures)
+        for chart in (self.ids.score_chart, self.ids.profitability_chart, self.ids.concentration_chart):
+            chart.plot(self.metric_history, self.duration)
+
+    # the metrics recorded per step of the session
+    def step_metrics(self):
+        return self.score, self.profitability, self.concentration, self.exposures
+
+    # simulate the credit VaR of the portfolio when the metric is enabled, with
+    # the loss scenarios of the session
+    @instrument.timed('update_credit_var')
+    def update_credit_var(self):
+        if self.loss_scenarios:
+            import montecarlo
+
+            self.credit_var = montecarlo.credit_var(self.portfolio, scenarios=int(self.loss_scenarios),
+                                                    seed=self.session_seeder.scenario_seed)
+
+    @instrument.timed('update_color')
     def update_color(self):
 
         if self.score > self.score_p:
@@ -291,28 +677,38 @@ class Root(BoxLayout):
     #
     # execute this whenever there is a portfolio data refresh event
     #
+    @instrument.timed('display_portfolio')
     def display_portfolio(self, selected_id):
-        # clear any previously bound widgets
-        self.slayout.clear_widgets()
-
-        for i in range(len(self.portfolio)):
-            loanid = self.portfolio[i]['index']
-            el = self.portfolio[i]['el']
-            s = self.portfolio[i]['s']
-            exp = self.portfolio[i]['exp']
-            if i == selected_id:
-                btn = ToggleButton(size_hint=(exp, 0.05), group='Data', text=str(i + 1), state='down')
-                btn.ID = str(i)
-            else:
-                btn = ToggleButton(size_hint=(exp, 0.05), group='Data', text=str(i + 1))
-                btn.ID = str(i)
-            self.slayout.add_widget(btn)
-            btn.bind(on_press=self.select_other)
+        self.slayout.show(self.portfolio, selected_id)
+
+    #
+    # the popups are built once and kept, opening one again only updates what changes
+    #
+    def popup(self, name):
+        if name not in self.popups:
+            popup = getattr(self, 'build_' + name)()
+            # lay the content out at the size the popup opens with, not the
+            # default 100 px
+            popup.size = Window.size
+            self.popups[name] = popup
+        return self.popups[name]
+
+    # build all popups ahead of their first use
+    def build_popups(self, *args):
+        started = time.perf_counter()
+        for name in ('about', 'learn', 'gameover'):
+            self.popup(name)
+        if startup.PROFILE or instrument.ENABLED:
+            Logger.info('Startup: popups built in {:.1f} ms'.format(1000 * (time.perf_counter() - started)))
 
     #
     # function to show an About popup
     #
+    @instrument.timed('about_popup')
     def about_popup(self):
+        self.popup('about').open()
+
+    def build_about(self):
 
         about = """
 FuriousBanker: [i]The Credit Detox Challenge[/i]. Version 0.3
@@ -331,12 +727,16 @@ Open Risk is an independent provider of training and risk analysis tools to the
         content.add_widget(btnclose)
         popup = Popup(title='About', content=content, size_hint=(1, 1))
         btnclose.bind(on_release=popup.dismiss)
-        popup.open()
+        return popup
 
     #
     # function to show the instructions popup
     #
+    @instrument.timed('learn_popup')
     def learn_popup(self):
+        self.popup('learn').open()
+
+    def build_learn(self):
 
         objective = """You inherited a pretty toxic portfolio and your objective is to reduce the concentration risk, even while improving your profitability. 
     
@@ -363,8 +763,10 @@ Your game score combines profitability and concentration (it is actually the rat
 """
 
         btnclose = Button(text='Close', size_hint_y=None, height='30sp')
-        content = BoxLayout(orientation='vertical')
-        items = Accordion(orientation='horizontal')
+        # sized like the window from the start, the accordion aborts any layout
+        # narrower than its item titles
+        content = BoxLayout(orientation='vertical', size=Window.size)
+        items = Accordion(orientation='horizontal', size=Window.size)
         item1 = AccordionItem(title="Metrics")
         item1.add_widget(Label(font_size='16sp', text_size=(420, None), markup=True, text=metrics))
         items.add_widget(item1)
@@ -381,29 +783,149 @@ Your game score combines profitability and concentration (it is actually the rat
         content.add_widget(btnclose)
         popup = Popup(title='Instructions', content=content, size_hint=(1, 1))
         btnclose.bind(on_release=popup.dismiss)
-        popup.open()
+        return popup
 
     #
     # function to show a Game Over popup
     #
+    @instrument.timed('show_gameover')
     def show_gameover(self, instance):
-        btnclose = Button(text='Restart', size_hint_y=None, height='50sp')
-        content = BoxLayout(orientation='vertical')
+        popup = self.popup('gameover')
+        content = popup.content
+        content.clear_widgets()
         # Top label
-        content.add_widget(Label(text='You have run out of time!'))
+        content.add_widget(popup.top_label)
         # Conditional on score
         if self.score > self.winning_score:
-            content.add_widget(Image(source='data/FuriousBankerH1.png', pos=(400, 100), size=(256, 256)))
-            content.add_widget(Label(text='You managed to detox the portfolio!'))
+            popup.image.texture = assets.texture('FuriousBankerH1')
+            popup.result.text = 'You managed to detox the portfolio!'
         else:
-            content.add_widget(Image(source='data/FuriousBankerA1.png', pos=(400, 100), size=(256, 256)))
-            content.add_widget(Label(text='You failed to detox the portfolio!'))
+            popup.image.texture = assets.texture('FuriousBankerA1')
+            popup.result.text = 'You failed to detox the portfolio!'
+        content.add_widget(popup.image)
+        content.add_widget(popup.result)
+        session = self.session_record() if self.session_store is not None else None
+        if self.session_store is not None:
+            popup.leaderboard.text = ''
+        # the solver and the review assume a static portfolio
+        if self.dynamics is None:
+            popup.best.text = 'Best possible score: ...'
+            content.add_widget(popup.best)
+            review = self.review()
+            if review is not None:
+                popup.review.text = 'Rejecting deal {} instead would have scored {}'.format(*review)
+                content.add_widget(popup.review)
+            # the session is saved once its best score is known
+            self.find_best_score(popup, session)
+        elif session is not None:
+            self.save_session(session, popup.leaderboard)
+        if self.AC.metrics_export:
+            self.export_metrics()
+        if self.session_store is not None:
+            content.add_widget(popup.leaderboard)
         # Bottom button
-        content.add_widget(btnclose)
+        content.add_widget(popup.restart)
+        popup.open()
+        instrument.report(Logger.info)
+
+    # the Game Over popup with all the widgets show_gameover may show
+    def build_gameover(self):
+        content = BoxLayout(orientation='vertical')
         popup = Popup(title='Game Over', content=content, size_hint=(1, 1))
+        popup.top_label = Label(text='You have run out of time!')
+        popup.image = Image(pos=(400, 100), size=(256, 256))
+        popup.result = Label()
+        popup.best = Label()
+        popup.review = Label()
+        popup.leaderboard = Label(text='')
+        popup.restart = Button(text='Restart', size_hint_y=None, height='50sp')
         popup.bind(on_dismiss=self.onclose)
-        btnclose.bind(on_release=popup.dismiss)
-        popup.open()
+        popup.restart.bind(on_release=popup.dismiss)
+        return popup
+
+    # the best score the initial portfolio and the offered proposals allowed,
+    # never below the score reached. It is solved on a background thread so the
+    # game over popup opens at once, the popup shows it when it is known (as a
+    # lower bound if the solver stopped at its time limit) and the session, if
+    # any, is saved with it.
+    def find_best_score(self, popup, session=None):
+        import solver
+
+        portfolio = self.initial_portfolio.copy()
+        proposals = list(zip(*self.session_loans[:int(self.new_loan_limit)]))
+        base = self.metrics.base
+        reached = self.score
+
+        def solve():
+            try:
+                solution = solver.solve(portfolio, proposals, base=base)
+                score = max(solution.score, reached)
+                self.show_best_score(popup.best, score, solution.optimal)
+            except Exception as e:
+                Logger.warning('Solver: no best score: {}'.format(e))
+                score = None
+            if session is not None:
+                session[0]['best_score'] = score
+                self.save_session(session, popup.leaderboard)
+
+        threading.Thread(target=solve, name='best-score').start()
+
+    @mainthread
+    def show_best_score(self, label, score, optimal):
+        label.text = 'Best possible score: {}{}'.format('' if optimal else 'at least ', score)
+
+    # what if one accepted proposal had been rejected and every other decision
+    # kept: the deal number and final score of the best such change if it beats
+    # the score reached, otherwise None
+    def review(self):
+        timeline = self.history.timeline()
+        best = None
+        for deal, version in enumerate(timeline[1:], 1):
+            if self.history[version].accepted:
+                score = self.history.what_if(version, REJECT).score
+                if score > self.score and (best is None or score > best[1]):
+                    best = (deal, score)
+        return best
+
+    # write the metric history of the session to the metrics_export directory,
+    # on a background thread so the game over popup does not wait for the disk
+    def export_metrics(self):
+        path = os.path.join(self.AC.metrics_export, '{}-{}.csv'.format(self.player, time.strftime('%Y%m%d-%H%M%S')))
+        rows = self.metric_history.array()
+
+        def write():
+            try:
+                os.makedirs(self.AC.metrics_export, exist_ok=True)
+                timeseries.export(path, rows)
+            except OSError as e:
+                Logger.warning('Metrics: export to {} failed: {}'.format(path, e))
+
+        threading.Thread(target=write, name='metrics-export').start()
+
+    # the finished session as saved in the session store: its fields and trajectory
+    def session_record(self, best_score=None):
+        return {
+            'player': self.player,
+            'finished': time.time(),
+            'duration': self.game_clock.elapsed(),
+            'score': self.score,
+            'profitability': self.profitability,
+            'concentration': self.concentration,
+            'exposure': self.exposures,
+            'won': self.score > self.winning_score,
+            'proposals': self.new_loan_count,
+            'accepted': self.accepted_count,
+            'best_score': best_score,
+        }, list(self.trajectory)
+
+    # queue the finished session for the session store (written off the UI
+    # thread) and show the leaderboard including it
+    def save_session(self, session, leaderboard):
+        self.session_store.save(*session)
+        self.session_store.leaderboard(mainthread(lambda rows: self.show_leaderboard(leaderboard, rows)), 5)
+
+    def show_leaderboard(self, label, rows):
+        label.text = '\n'.join('{}. {}  {}'.format(i + 1, player, score) for i, (player, score, _) in enumerate(rows))
 
     #
     # cleaning up before shutting down
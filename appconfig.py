@@ -0,0 +1,66 @@
+# encoding: utf-8
+
+# (c) 2014-2024 Open Risk, all rights reserved
+#
+# FuriousBanker is licensed under the MIT license a copy of which is included
+# in the source distribution of FuriousBanker. This is notwithstanding any licenses of
+# third-party software included in this distribution. You may not use this file except in
+# compliance with the License.
+#
+# Unless required by applicable law or agreed to in writing, software distributed under
+# the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND,
+# either express or implied. See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import functools
+import os
+
+# configuration files written for the unsafe loader tag the mapping as a python object
+LEGACY_TAG = 'tag:yaml.org,2002:python/object:FuriousBanker.AppConfig'
+
+
+class AppConfig:
+
+    def __init__(self):
+        self.new_loan_limit = None
+        self.profitability = None
+        self.concentration = None
+        self.profitability_p = None
+        self.concentration_p = None
+        self.portfolio_size = None
+        self.duration = None
+        self.time_delta = None
+        # entries added after the first release need a default, older
+        # configuration files do not have them
+        self.time_delta_max = 1.0
+        self.winning_score = None
+        self.seed = None
+        self.loss_scenarios = None
+        self.event_log = None
+        self.session_store = None
+        self.player = None
+        self.loan_book = None
+        self.metrics_export = None
+        self.dynamics_period = None
+
+    @classmethod
+    def from_dict(cls, values):
+        config = cls()
+        for key, value in values.items():
+            if not hasattr(config, key):
+                raise ValueError('unknown configuration entry: {}'.format(key))
+            setattr(config, key, value)
+        return config
+
+
+# load the game configuration with the safe YAML loader, the result is cached
+# per file so repeated calls (e.g. from worker processes) parse it only once
+@functools.lru_cache(maxsize=None)
+def load_config(path='configuration.yml'):
+    from ruamel.yaml import YAML
+
+    yaml = YAML(typ='safe')
+    yaml.constructor.add_constructor(LEGACY_TAG, lambda constructor, node: constructor.construct_mapping(node))
+    with open(os.path.abspath(path), 'r') as f:
+        return AppConfig.from_dict(yaml.load(f))
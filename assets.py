@@ -0,0 +1,117 @@
+# encoding: utf-8
+
+# (c) 2014-2024 Open Risk, all rights reserved
+#
+# FuriousBanker is licensed under the MIT license a copy of which is included
+# in the source distribution of FuriousBanker. This is notwithstanding any licenses of
+# third-party software included in this distribution. You may not use this file except in
+# compliance with the License.
+#
+# Unless required by applicable law or agreed to in writing, software distributed under
+# the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND,
+# either express or implied. See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import json
+import os
+import time
+
+# Game images
+#
+# The images in data are packed into one texture atlas that ships with the game
+# (rebuilt with python assets.py after an image changes, which needs Pillow) and
+# preloaded at startup: the Kivy Loader decodes them on its worker threads and
+# uploads the textures on the main thread, so no image is read from disk when a
+# popup opens. Images that are not in the atlas (or all of them, without an
+# atlas) are preloaded from their own files instead.
+#
+#   python assets.py
+
+DATA = 'data'
+ATLAS = os.path.join(DATA, 'furiousbanker.atlas')
+IMAGES = ('FuriousBanker', 'FuriousBankerA1', 'FuriousBankerA2', 'FuriousBankerH1', 'FuriousBankerH2', 'Overview')
+
+_textures = {}
+_proxies = []
+_atlas = []
+
+
+# pack IMAGES into the atlas (pages of size pixels), returns the atlas meta data
+def build_atlas(size=(2048, 1024)):
+    from kivy.atlas import Atlas
+
+    filename, meta = Atlas.create(ATLAS[:-len('.atlas')], [os.path.join(DATA, name + '.png') for name in IMAGES], size)
+    return meta
+
+
+# the atlas pages as {file: {name: region}}, read once (empty without an atlas)
+def _atlas_pages():
+    if not _atlas:
+        pages = {}
+        if os.path.exists(ATLAS):
+            with open(ATLAS, 'r') as f:
+                pages = {os.path.join(DATA, page): ids for page, ids in json.load(f).items()}
+        _atlas.append(pages)
+    return _atlas[0]
+
+
+# Image source of a game image, from the atlas if it holds the image
+def source(name):
+    if any(name in ids for ids in _atlas_pages().values()):
+        return 'atlas://{}/{}'.format(ATLAS[:-len('.atlas')].replace(os.sep, '/'), name)
+    return os.path.join(DATA, name + '.png')
+
+
+# the image files to load with the images they hold, as {file: {name: region}}
+# (region None for a whole image)
+def _pages():
+    pages = dict(_atlas_pages())
+    packed = {name for ids in pages.values() for name in ids}
+    pages.update((os.path.join(DATA, name + '.png'), {name: None}) for name in IMAGES if name not in packed)
+    return pages
+
+
+# start loading all game images in the background, on_done(ms) is called on
+# the main thread once every texture is ready
+def preload(on_done=None):
+    from kivy.loader import Loader
+
+    started = time.perf_counter()
+    pages = _pages()
+    remaining = [len(pages)]
+
+    def loaded(proxy, ids):
+        texture = proxy.image.texture
+        if texture is None:
+            return
+        for name, region in ids.items():
+            _textures[name] = texture if region is None else texture.get_region(*region)
+        remaining[0] -= 1
+        if remaining[0] == 0 and on_done is not None:
+            on_done(1000 * (time.perf_counter() - started))
+
+    for filename, ids in pages.items():
+        proxy = Loader.image(filename)
+        _proxies.append(proxy)
+        if proxy.loaded:
+            loaded(proxy, ids)
+        else:
+            proxy.bind(on_load=lambda proxy, ids=ids: loaded(proxy, ids))
+
+
+# texture of a game image, the preloaded one or else loaded now
+def texture(name):
+    if name not in _textures:
+        from kivy.core.image import Image as CoreImage
+
+        _textures[name] = CoreImage(source(name)).texture
+    return _textures[name]
+
+
+if __name__ == '__main__':
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    for page in _atlas_pages():
+        os.remove(page)
+    meta = build_atlas()
+    print('{}: {} pages, {} images'.format(ATLAS, len(meta), sum(len(ids) for ids in meta.values())))
@@ -0,0 +1,180 @@
+# encoding: utf-8
+
+# (c) 2014-2024 Open Risk, all rights reserved
+#
+# FuriousBanker is licensed under the MIT license a copy of which is included
+# in the source distribution of FuriousBanker. This is notwithstanding any licenses of
+# third-party software included in this distribution. You may not use this file except in
+# compliance with the License.
+#
+# Unless required by applicable law or agreed to in writing, software distributed under
+# the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND,
+# either express or implied. See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Benchmark of the calculator functions across portfolio sizes
+#
+# Times init, newloan, profit, exposure, risky_hhi, basic_hhi and score for portfolio
+# sizes from the configured game size up to 10^6 loans, recording per-call latency,
+# throughput and peak (traced) memory. Results are written as JSON and compared
+# against a stored baseline, regressions beyond the tolerance are flagged and make
+# the script exit with a non-zero status.
+#
+#   python benchmarks/bench_calculator.py                  # run and compare
+#   python benchmarks/bench_calculator.py --save-baseline  # run and store as baseline
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+sys.path.insert(0, ROOT)
+
+import appconfig  # noqa: E402
+import calculator  # noqa: E402
+
+FUNCTIONS = ['init', 'newloan', 'profit', 'exposure', 'risky_hhi', 'basic_hhi', 'score']
+
+
+def configured_size():
+    return appconfig.load_config(os.path.join(ROOT, 'configuration.yml')).portfolio_size
+
+
+def default_sizes():
+    return [configured_size()] + [10 ** k for k in range(2, 7)]
+
+
+# a zero argument callable running one call of the benchmarked function
+def make_call(name, size, portfolio):
+    if name == 'init':
+        return lambda: calculator.init(size)
+    if name == 'newloan':
+        return calculator.newloan
+    function = getattr(calculator, name)
+    return lambda: function(portfolio)
+
+
+# seconds per call: best and median over repeats of enough calls to last min_time
+def time_call(call, repeat, min_time):
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            call()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            break
+        number *= 2 if elapsed <= 0 else max(2, int(min_time / elapsed) + 1)
+    runs = [elapsed / number]
+    for _ in range(repeat - 1):
+        start = time.perf_counter()
+        for _ in range(number):
+            call()
+        runs.append((time.perf_counter() - start) / number)
+    return min(runs), statistics.median(runs)
+
+
+# peak traced memory of a single call in bytes
+def peak_memory(call):
+    tracemalloc.start()
+    try:
+        call()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def run(sizes, functions, repeat, min_time):
+    results = []
+    for size in sizes:
+        portfolio = calculator.init(size)
+        for name in functions:
+            # newloan does not depend on the portfolio, time it once
+            if name == 'newloan' and size != sizes[0]:
+                continue
+            call = make_call(name, size, portfolio)
+            call()
+            best, median = time_call(call, repeat, min_time)
+            loans = 1 if name == 'newloan' else size
+            results.append({
+                'function': name,
+                'size': loans,
+                'latency_s': best,
+                'latency_median_s': median,
+                'calls_per_s': 1.0 / best,
+                'loans_per_s': loans / best,
+                'peak_bytes': peak_memory(call),
+            })
+            print('{:<10} {:>8} {:>12.3f} us {:>14.0f} loans/s {:>12} B'.format(
+                name, loans, 1e6 * best, loans / best, results[-1]['peak_bytes']))
+    return results
+
+
+# compare latencies with the baseline, returns the regressed entries
+def compare(results, baseline, tolerance):
+    reference = {(r['function'], r['size']): r for r in baseline['results']}
+    regressions = []
+    for r in results:
+        base = reference.get((r['function'], r['size']))
+        if base is None:
+            continue
+        ratio = r['latency_s'] / base['latency_s']
+        r['baseline_ratio'] = ratio
+        if ratio > 1.0 + tolerance:
+            regressions.append(r)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the FuriousBanker calculator functions')
+    parser.add_argument('--sizes', type=int, nargs='+', help='portfolio sizes (default: configured size up to 10^6)')
+    parser.add_argument('--functions', nargs='+', choices=FUNCTIONS, default=FUNCTIONS)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--min-time', type=float, default=0.05, help='minimum seconds per timing run')
+    parser.add_argument('--output', default=os.path.join(HERE, 'results.json'))
+    parser.add_argument('--baseline', default=os.path.join(HERE, 'baseline.json'))
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed relative slowdown')
+    parser.add_argument('--save-baseline', action='store_true', help='store the results as the new baseline')
+    args = parser.parse_args(argv)
+
+    # the risky HHI rounds to 0 on very large portfolios, making the score infinite
+    with np.errstate(divide='ignore'):
+        results = run(args.sizes or default_sizes(), args.functions, args.repeat, args.min_time)
+    report = {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'machine': platform.platform(),
+        'results': results,
+    }
+
+    status = 0
+    if args.save_baseline:
+        path = args.baseline
+    else:
+        path = args.output
+        if os.path.exists(args.baseline):
+            with open(args.baseline, 'r') as f:
+                regressions = compare(results, json.load(f), args.tolerance)
+            for r in regressions:
+                print('REGRESSION {} size {}: {:.2f}x baseline latency'.format(r['function'], r['size'], r['baseline_ratio']))
+            status = 1 if regressions else 0
+        else:
+            print('no baseline at {}, run with --save-baseline to create one'.format(args.baseline))
+
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2)
+    print('results written to {}'.format(path))
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
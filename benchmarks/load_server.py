@@ -0,0 +1,148 @@
+# encoding: utf-8
+
+# (c) 2014-2024 Open Risk, all rights reserved
+#
+# FuriousBanker is licensed under the MIT license a copy of which is included
+# in the source distribution of FuriousBanker. This is notwithstanding any licenses of
+# third-party software included in this distribution. You may not use this file except in
+# compliance with the License.
+#
+# Unless required by applicable law or agreed to in writing, software distributed under
+# the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND,
+# either express or implied. See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Load generator for the game server
+#
+# Plays many simultaneous sessions over a number of connections. Sessions start
+# spread over a ramp up period, each waits think seconds (with jitter) between
+# its actions like a player would, and the action latency percentiles and the
+# throughput are reported. Without --port a server is started in a subprocess
+# on a free port.
+#
+#   python benchmarks/load_server.py --sessions 2000 --connections 50
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+
+
+class Connection:
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.next_id = 0
+        self.waiting = {}
+        self.listener = asyncio.ensure_future(self.listen())
+
+    async def listen(self):
+        async for line in self.reader:
+            response = json.loads(line)
+            self.waiting.pop(response['id']).set_result(response)
+
+    # send a request and wait for its response
+    async def request(self, **request):
+        request['id'] = self.next_id
+        self.next_id += 1
+        future = asyncio.get_running_loop().create_future()
+        self.waiting[request['id']] = future
+        self.writer.write(json.dumps(request).encode() + b'\n')
+        return await future
+
+
+# play one session with random decisions, appends the action latencies
+async def play(connection, actions, think, ramp, latencies, rng):
+    await asyncio.sleep(ramp * rng.random())
+    state = await connection.request(op='new')
+    session = state['session']
+    size = len(state['portfolio'])
+    for _ in range(actions):
+        await asyncio.sleep(think * rng.uniform(0.5, 1.5))
+        start = time.perf_counter()
+        if rng.random() < 0.3:
+            state = await connection.request(op='accept', session=session, slot=rng.randrange(size))
+        else:
+            state = await connection.request(op='reject', session=session)
+        latencies.append(time.perf_counter() - start)
+        if state['done']:
+            break
+    await connection.request(op='close', session=session)
+
+
+async def run(host, port, sessions, connections, actions, think, ramp):
+    streams = [await asyncio.open_connection(host, port, limit=2 ** 16) for _ in range(connections)]
+    clients = [Connection(reader, writer) for reader, writer in streams]
+    latencies = []
+    rng = random.Random(0)
+    start = time.perf_counter()
+    await asyncio.gather(*(play(clients[k % connections], actions, think, ramp, latencies,
+                                random.Random(rng.random())) for k in range(sessions)))
+    elapsed = time.perf_counter() - start
+    for client in clients:
+        client.writer.close()
+        client.listener.cancel()
+    return np.array(latencies), elapsed
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_for(host, port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection((host, port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError('server did not start')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test of the game server')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=None, help='port of a running server (default: start one)')
+    parser.add_argument('--sessions', type=int, default=2000)
+    parser.add_argument('--connections', type=int, default=50)
+    parser.add_argument('--actions', type=int, default=100, help='actions per session')
+    parser.add_argument('--think', type=float, default=0.5, help='mean seconds between the actions of a session')
+    parser.add_argument('--ramp', type=float, default=10.0, help='seconds over which the sessions start')
+    args = parser.parse_args()
+
+    process = None
+    port = args.port
+    if port is None:
+        port = free_port()
+        process = subprocess.Popen([sys.executable, os.path.join(ROOT, 'server.py'), '--port', str(port),
+                                    '--config', os.path.join(ROOT, 'configuration.yml')], cwd=ROOT)
+    try:
+        wait_for(args.host, port)
+        latencies, elapsed = asyncio.run(run(args.host, port, args.sessions, args.connections, args.actions,
+                                             args.think, args.ramp))
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+    p50, p99 = np.percentile(latencies, [50, 99]) * 1000
+    print('{} sessions over {} connections, {} actions in {:.1f} s ({:.0f} actions/s)'.format(
+        args.sessions, args.connections, latencies.size, elapsed, latencies.size / elapsed))
+    print('action latency: p50 {:.2f} ms  p99 {:.2f} ms  max {:.2f} ms'.format(p50, p99, latencies.max() * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -13,85 +13,324 @@
 # limitations under the License.
 
 
-import random
+from collections.abc import Mapping
 
-import concentrationMetrics as cm
+import numpy as np
 
+_rng = np.random.default_rng()
 
-# initialize portfolio to random values
-def init(size):
-    # print('init')
-    portfolio = {}
 
-    large_i = int(10 * random.random())
-    medium_i = int(10 * random.random())
+# columnar loan portfolio: one contiguous float64 array per loan attribute
+# indexing returns a dict-like view of a loan so that code written against the
+# original dict of dicts ({"index", "el", "s", "exp"}) keeps working unchanged
+class Portfolio:
+
+    def __init__(self, el, s, exp):
+        self.el = np.array(el, dtype=np.float64)
+        self.s = np.array(s, dtype=np.float64)
+        self.exp = np.array(exp, dtype=np.float64)
+        if not (self.el.ndim == 1 and self.el.shape == self.s.shape == self.exp.shape):
+            raise ValueError('el, s and exp must be one dimensional arrays of equal length')
+
+    # build from the dict of dicts representation
+    @classmethod
+    def from_dict(cls, portfolio):
+        loans = [portfolio[i] for i in range(len(portfolio))]
+        return cls([loan['el'] for loan in loans], [loan['s'] for loan in loans], [loan['exp'] for loan in loans])
+
+    # export to the dict of dicts representation
+    def to_dict(self):
+        return {i: dict(self[i]) for i in range(len(self))}
+
+    def copy(self):
+        return Portfolio(self.el, self.s, self.exp)
+
+    # overwrite the loan in slot i
+    def replace(self, i, el, s, exp):
+        self.el[i] = el
+        self.s[i] = s
+        self.exp[i] = exp
+
+    def __len__(self):
+        return self.el.size
+
+    def __iter__(self):
+        return iter(range(len(self)))
+
+    def __contains__(self, i):
+        return isinstance(i, (int, np.integer)) and 0 <= i < len(self)
+
+    def __getitem__(self, i):
+        if i not in self:
+            raise KeyError(i)
+        return Loan(self, int(i))
+
+    def __setitem__(self, i, loan):
+        if i not in self:
+            raise KeyError(i)
+        self.replace(i, loan['el'], loan['s'], loan['exp'])
+
+    def keys(self):
+        return range(len(self))
+
+    def values(self):
+        return [self[i] for i in self]
+
+    def items(self):
+        return [(i, self[i]) for i in self]
+
 
-    for i in range(size):
-        el = max(0.005, random.gauss(0.05, 0.05))
-        s = min(1.0, max(0.0, el * (1 + random.random())))
-        exp = min(0.3, max(0.1, 0.3 * random.random()))
-        if i == medium_i:
-            exp = 0.8
-        if i == large_i:
-            exp = 1.0
-        portfolio[i] = {"index": i, "el": round(el, 2), "s": round(s, 2), "exp": round(exp, 2)}
+# dict-like view of a single loan, writes go through to the portfolio arrays
+class Loan(Mapping):
+    _fields = ('index', 'el', 's', 'exp')
 
-    return portfolio
+    def __init__(self, portfolio, i):
+        self._portfolio = portfolio
+        self._i = i
+
+    def __getitem__(self, key):
+        if key == 'index':
+            return self._i
+        if key in self._fields:
+            return float(getattr(self._portfolio, key)[self._i])
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if key not in self._fields[1:]:
+            raise KeyError(key)
+        getattr(self._portfolio, key)[self._i] = value
+
+    def __iter__(self):
+        return iter(self._fields)
+
+    def __len__(self):
+        return len(self._fields)
+
+    def __repr__(self):
+        return repr(dict(self))
+
+
+# accept either representation, dicts are converted (no copy for a Portfolio)
+def as_portfolio(portfolio):
+    if isinstance(portfolio, Portfolio):
+        return portfolio
+    return Portfolio.from_dict(portfolio)
+
+
+# draw random portfolio loans as (el, s, exp) arrays of the given shape, the
+# last axis is the portfolio, leading axes index independent portfolios
+def init_loans(shape, rng=None):
+    rng = _rng if rng is None else rng
+    shape = np.atleast_1d(shape)
+    large_i = rng.integers(10, size=(*shape[:-1], 1))
+    medium_i = rng.integers(10, size=(*shape[:-1], 1))
+
+    el = np.maximum(0.005, rng.normal(0.05, 0.05, shape))
+    s = np.clip(el * (1 + rng.random(shape)), 0.0, 1.0)
+    exp = np.clip(0.3 * rng.random(shape), 0.1, 0.3)
+    slots = np.arange(shape[-1])
+    exp = np.where(slots == medium_i, 0.8, exp)
+    exp = np.where(slots == large_i, 1.0, exp)
+    return round_loans(el, s, exp)
+
+
+# draw random new loan proposals as (el, s, exp) arrays of the given shape
+def newloans(shape, rng=None):
+    rng = _rng if rng is None else rng
+    el = np.maximum(0.005, rng.normal(0.05, 0.05, shape))
+    s = np.clip(el * (1 + rng.random(shape)), 0.0, 1.0)
+    exp = np.clip(rng.random(shape), 0.1, 1.0)
+    return round_loans(el, s, exp)
+
+
+# round loan data to two decimals like the displayed values
+def round_loans(el, s, exp):
+    # numpy rounds half to even, which would send the 0.005 floor to 0.0
+    return np.maximum(0.01, np.round(el, 2)), np.round(s, 2), np.round(exp, 2)
+
+
+# initialize portfolio to random values
+def init(size, rng=None):
+    # print('init')
+    return Portfolio(*init_loans(size, rng))
 
 
 # create random new loan
-def newloan():
+def newloan(rng=None):
     # print('newloan')
-    el = max(0.005, random.gauss(0.05, 0.05))
-    s = min(1.0, max(0.0, el * (1 + random.random())))
-    exp = min(1.0, max(0.1, random.random()))
-    return [round(el, 2), round(s, 2), round(exp, 2)]
+    return [float(x) for x in newloans((), rng)]
+
+
+# the running sums all metrics are built from, reduced over the last axis:
+# total exposure, sum of (s - el) * exp, sum of el * exp, sum of el * exp^2
+def sums(el, s, exp):
+    el_exp = el * exp
+    return exp.sum(axis=-1), (s * exp - el_exp).sum(axis=-1), el_exp.sum(axis=-1), (el_exp * exp).sum(axis=-1)
+
+
+# metrics from the running sums (works elementwise on arrays of sums)
+def exposure_from_sums(total):
+    return np.round(total, 2)
+
+
+def profit_from_sums(total, margin):
+    return 100 * margin / exposure_from_sums(total)
+
+
+def risky_hhi_from_sums(total, el_sum, el_sq_sum):
+    total = exposure_from_sums(total)
+    average = el_sum / total
+    hhi = el_sq_sum / total / total
+    return np.round(100 * hhi / average, 0)
+
+
+def score_from_sums(total, margin, el_sum, el_sq_sum):
+    risk = risky_hhi_from_sums(total, el_sum, el_sq_sum)
+    ret = profit_from_sums(total, margin)
+    return np.round(1000 * ret / risk, 1)
+
+
+# exposure, profitability, risky hhi and score from the running sums in one
+# pass, the shared intermediate results are computed only once
+def metrics_from_sums(total, margin, el_sum, el_sq_sum):
+    exposure = np.round(np.float64(total) if np.ndim(total) == 0 else total, 2)
+    ret = 100 * margin / exposure
+    risk = np.round(100 * (el_sq_sum / exposure / exposure) / (el_sum / exposure), 0)
+    return exposure, ret, risk, np.round(1000 * ret / risk, 1)
+
+
+# contribution of a single loan to each of the running sums
+def loan_sums(el, s, exp):
+    el_exp = el * exp
+    return exp, s * exp - el_exp, el_exp, el_exp * exp
+
+
+# stateful metrics accumulator: keeps the running sums of a portfolio and
+# updates them in constant time when one loan is replaced, a full recompute
+# (every recompute_every updates, or on demand) corrects floating point drift.
+# base holds the running sums of loans counted in the metrics but not in the
+# portfolio (the rest of a loan book), they are never replaced.
+class Metrics:
+
+    def __init__(self, portfolio, recompute_every=1000, base=None):
+        self.portfolio = as_portfolio(portfolio)
+        self.recompute_every = recompute_every
+        self.base = (0.0, 0.0, 0.0, 0.0) if base is None else tuple(float(x) for x in base)
+        self.recompute()
+
+    # recalculate the running sums from the full portfolio
+    def recompute(self):
+        p = self.portfolio
+        self.total, self.margin, self.el_sum, self.el_sq_sum = (
+            float(x) + b for x, b in zip(sums(p.el, p.s, p.exp), self.base))
+        self.updates = 0
+
+    # replace the loan in slot i (in the portfolio too) and update the sums
+    def replace(self, i, el, s, exp):
+        p = self.portfolio
+        old = loan_sums(float(p.el[i]), float(p.s[i]), float(p.exp[i]))
+        new = loan_sums(el, s, exp)
+        p.replace(i, el, s, exp)
+        self.total += new[0] - old[0]
+        self.margin += new[1] - old[1]
+        self.el_sum += new[2] - old[2]
+        self.el_sq_sum += new[3] - old[3]
+        self.updates += 1
+        if self.recompute_every and self.updates >= self.recompute_every:
+            self.recompute()
+
+    @property
+    def exposure(self):
+        return float(exposure_from_sums(self.total))
+
+    @property
+    def profit(self):
+        return float(profit_from_sums(self.total, self.margin))
+
+    @property
+    def risky_hhi(self):
+        return float(risky_hhi_from_sums(self.total, self.el_sum, self.el_sq_sum))
+
+    @property
+    def score(self):
+        return float(score_from_sums(self.total, self.margin, self.el_sum, self.el_sq_sum))
+
+
+# what-if analysis of a proposed loan: the profitability, risky HHI and score
+# the portfolio would have if the proposal replaced the loan in each slot,
+# computed for all slots in one vectorized pass (pass the portfolio Metrics to
+# reuse its running sums instead of reducing the portfolio again)
+# the arithmetic follows the *_from_sums functions but works in place, since
+# temporaries dominate the cost on large portfolios
+def swap_metrics(portfolio, el, s, exp, metrics=None):
+    p = as_portfolio(portfolio)
+    if metrics is None:
+        totals = sums(p.el, p.s, p.exp)
+    else:
+        totals = (metrics.total, metrics.margin, metrics.el_sum, metrics.el_sq_sum)
+    total_n, margin_n, el_sum_n, el_sq_sum_n = (t + n for t, n in zip(totals, loan_sums(el, s, exp)))
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        el_exp = p.el * p.exp
+        total = np.subtract(total_n, p.exp)
+        np.round(total, 2, out=total)
+        # profitability
+        ret = p.s * p.exp
+        ret -= el_exp
+        np.subtract(margin_n, ret, out=ret)
+        ret *= 100
+        ret /= total
+        # risky hhi
+        risk = el_exp * p.exp
+        np.subtract(el_sq_sum_n, risk, out=risk)
+        risk /= total
+        risk /= total
+        risk *= 100
+        np.subtract(el_sum_n, el_exp, out=el_exp)
+        el_exp /= total
+        risk /= el_exp
+        np.round(risk, 0, out=risk)
+        # score
+        result = 1000 * ret
+        result /= risk
+        np.round(result, 1, out=result)
+    return ret, risk, result
+
+
+# slot where accepting the proposed loan gives the highest score
+def best_swap(portfolio, el, s, exp, metrics=None):
+    _, _, result = swap_metrics(portfolio, el, s, exp, metrics)
+    return int(np.argmax(result))
 
 
 # calculate profitability of portfolio
 def profit(portfolio):
-    # print('profit')
-    sum = 0
-    total = exposure(portfolio)
-    for i in range(len(portfolio)):
-        loan = portfolio[i]
-        sum += (loan['s'] - loan['el']) * loan['exp']
-    return 100 * sum / total
+    p = as_portfolio(portfolio)
+    total, margin, _, _ = sums(p.el, p.s, p.exp)
+    return float(profit_from_sums(total, margin))
 
 
 # calculate total exposure
 def exposure(portfolio):
-    # print('exp')
-    total = 0
-    for i in range(len(portfolio)):
-        loan = portfolio[i]
-        total += loan['exp']
-    return round(total, 2)
+    p = as_portfolio(portfolio)
+    return float(exposure_from_sums(p.exp.sum()))
 
 
-# calculate concentration index using concentrationMetrics
+# calculate the (normalized) exposure HHI, as concentrationMetrics does
 def basic_hhi(portfolio):
-    Index = cm.Index()
-    hhi = Index.hhi(portfolio)
-    return hhi
+    import concentration
+
+    return float(concentration.hhi(as_portfolio(portfolio).exp))
 
 
 # calculate a risk weighted concentration index
 def risky_hhi(portfolio):
-    hhi = 0
-    average = 0
-    total = exposure(portfolio)
-    for i in range(len(portfolio)):
-        loan = portfolio[i]
-        average += loan['el'] * loan['exp']
-        hhi += loan['el'] * loan['exp'] * loan['exp'] / total / total
-    average = average / total
-    result = round(100 * hhi / average, 0)
-    return round(result, 0)
+    p = as_portfolio(portfolio)
+    total, _, el_sum, el_sq_sum = sums(p.el, p.s, p.exp)
+    return float(risky_hhi_from_sums(total, el_sum, el_sq_sum))
 
 
 # calculate game score index
 def score(portfolio):
-    risk = risky_hhi(portfolio)
-    ret = profit(portfolio)
-    return round(1000 * ret / risk, 1)
+    p = as_portfolio(portfolio)
+    return float(score_from_sums(*sums(p.el, p.s, p.exp)))
@@ -0,0 +1,312 @@
+# encoding: utf-8
+
+# (c) 2014-2024 Open Risk, all rights reserved
+#
+# FuriousBanker is licensed under the MIT license a copy of which is included
+# in the source distribution of FuriousBanker. This is notwithstanding any licenses of
+# third-party software included in this distribution. You may not use this file except in
+# compliance with the License.
+#
+# Unless required by applicable law or agreed to in writing, software distributed under
+# the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND,
+# either express or implied. See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Difficulty calibration of the game parameters
+#
+# Sweeps a grid of portfolio_size, new_loan_limit, duration and winning_score
+# values, plays simulated sessions with reference bots and reports the win
+# probability and the final score distribution of every configuration.
+#
+# The simulation has no clock: a player is assumed to need think seconds per
+# proposal, so a session decides on min(new_loan_limit, duration / think)
+# proposals. The winning score only enters through the tables, so the sessions
+# of a (bot, portfolio size, decisions) point serve every winning score and
+# every configuration with the same number of decisions. All bots play the same
+# sessions for a given seed.
+#
+# Sessions run in chunks on a process pool using every core. The final scores of
+# each chunk are cached as a .npy file as soon as it is done, a sweep that is
+# interrupted or extended later only runs the chunks that are missing.
+#
+# The optimal bot solves every session with a budget of solver nodes rather
+# than a time limit, so its cached scores do not depend on the machine. A
+# session not proved optimal within the budget scores the best subset found, a
+# lower bound of the optimum, and the share of such sessions is reported.
+#
+#   python calibrate.py --portfolio-size 8 12 16 --duration 120 300 --winning-score 300 500 700
+
+import argparse
+import csv
+import itertools
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+import appconfig
+import calculator
+import environment
+from environment import REJECT
+
+BOTS = ('passive', 'random', 'greedy', 'optimal')
+PARAMETERS = ('portfolio_size', 'new_loan_limit', 'duration', 'winning_score')
+QUANTILES = (5, 25, 50, 75, 95)
+
+# seconds a player needs per proposal
+THINK = 3.0
+
+# part of the cache file names, changed when the results of a bot change so
+# that older cached chunks are not reused
+VERSION = 3
+
+# solver nodes per session of the optimal bot
+NODES = 5000
+
+
+# number of proposals decided on in a session
+def decisions(new_loan_limit, duration, think=THINK):
+    if duration is None or not think:
+        return int(new_loan_limit)
+    return int(min(new_loan_limit, duration // think))
+
+
+# final scores of games sessions of a bot and whether each score is proved
+# (only the optimal bot has unproved ones), as a (2, games) array. The sessions
+# are set by entropy.
+def simulate(bot, portfolio_size, decisions, games, entropy, nodes=NODES):
+    env = environment.CreditDetoxEnv(games, portfolio_size, decisions, seed=np.random.SeedSequence(entropy))
+    if bot == 'optimal':
+        return _optimal(env, nodes)
+    if bot == 'passive':
+        def policy(obs):
+            return np.full(games, REJECT)
+    elif bot == 'random':
+        rng = np.random.default_rng(np.random.SeedSequence(list(entropy) + [len(BOTS)]))
+
+        def policy(obs):
+            return rng.integers(REJECT, portfolio_size, games)
+    elif bot == 'greedy':
+        import solver
+
+        policy = solver.greedy_policy
+    else:
+        raise ValueError('unknown bot: {}'.format(bot))
+    return np.stack([np.asarray(environment.run_episodes(env, policy), dtype=np.float64), np.ones(games)])
+
+
+# best possible score of the sessions of env (the ones the other bots play)
+# within nodes solver nodes per session, with the proved flags
+def _optimal(env, nodes):
+    import solver
+
+    obs = env.reset()
+    el, s, exp = obs['el'].copy(), obs['s'].copy(), obs['exp'].copy()
+    proposals = np.empty((env.n_games, 3, env.new_loan_limit))
+    for t in range(env.new_loan_limit):
+        proposals[:, :, t] = obs['new_loan']
+        obs = env.step(np.full(env.n_games, REJECT))[0]
+    results = np.empty((2, env.n_games))
+    for k in range(env.n_games):
+        solution = solver.solve(calculator.Portfolio(el[k], s[k], exp[k]), proposals[k], time_limit=None,
+                                nodes=nodes)
+        results[:, k] = solution.score, solution.optimal
+    return results
+
+
+# a chunk of sessions of a (bot, portfolio_size, decisions) point
+class Chunk:
+
+    def __init__(self, bot, portfolio_size, decisions, index, games, seed, nodes=NODES):
+        self.bot = bot
+        self.portfolio_size = portfolio_size
+        self.decisions = decisions
+        self.index = index
+        self.games = games
+        self.seed = seed
+        self.nodes = nodes
+
+    @property
+    def entropy(self):
+        return [self.seed, self.portfolio_size, self.decisions, self.index]
+
+    @property
+    def name(self):
+        bot = '{}{}'.format(self.bot, self.nodes) if self.bot == 'optimal' else self.bot
+        return '{}-v{}-size{}-deals{}-seed{}-chunk{}x{}.npy'.format(
+            bot, VERSION, self.portfolio_size, self.decisions, self.seed, self.index, self.games)
+
+
+def _run(chunk):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return simulate(chunk.bot, chunk.portfolio_size, chunk.decisions, chunk.games, chunk.entropy, chunk.nodes)
+
+
+# write through a temporary file so an interrupted write leaves no partial cache entry
+def _save(path, scores):
+    temporary = path + '.tmp'
+    with open(temporary, 'wb') as f:
+        np.save(f, scores)
+    os.replace(temporary, path)
+
+
+# the configurations of a grid (dict of parameter -> values, missing parameters
+# take the value in config) as dicts
+def configurations(grid, config):
+    values = [grid.get(name) or [getattr(config, name)] for name in PARAMETERS]
+    return [dict(zip(PARAMETERS, combination)) for combination in itertools.product(*values)]
+
+
+class Sweep:
+
+    def __init__(self, grid, bots=('greedy',), sessions=1000, chunk=500, seed=0, think=THINK, cache='calibration',
+                 config=None, nodes=NODES):
+        self.config = config or appconfig.load_config()
+        self.configurations = configurations(grid, self.config)
+        for c in self.configurations:
+            c['decisions'] = decisions(c['new_loan_limit'], c['duration'], think)
+        self.bots = list(bots)
+        self.sessions = sessions
+        self.chunk = chunk
+        self.seed = seed
+        self.cache = cache
+        points = sorted({(c['portfolio_size'], c['decisions']) for c in self.configurations})
+        sizes = [min(chunk, sessions - start) for start in range(0, sessions, chunk)]
+        self.chunks = {(bot, size, deals): [Chunk(bot, size, deals, k, n, seed, nodes) for k, n in enumerate(sizes)]
+                       for bot in self.bots for size, deals in points}
+
+    def path(self, chunk):
+        return os.path.join(self.cache, chunk.name)
+
+    # the chunks without a cached result
+    def missing(self):
+        return [c for chunks in self.chunks.values() for c in chunks if not os.path.exists(self.path(c))]
+
+    # run the missing chunks, processes=None uses every core. progress(done,
+    # total) is called after every chunk. An interrupted run keeps the finished
+    # chunks.
+    def run(self, processes=None, progress=None):
+        os.makedirs(self.cache, exist_ok=True)
+        todo = self.missing()
+        processes = processes or os.cpu_count() or 1
+        if processes == 1:
+            for done, chunk in enumerate(todo, 1):
+                _save(self.path(chunk), _run(chunk))
+                if progress is not None:
+                    progress(done, len(todo))
+            return
+        executor = ProcessPoolExecutor(processes)
+        try:
+            futures = {executor.submit(_run, chunk): chunk for chunk in todo}
+            for done, future in enumerate(as_completed(futures), 1):
+                _save(self.path(futures[future]), future.result())
+                if progress is not None:
+                    progress(done, len(todo))
+        finally:
+            executor.shutdown(cancel_futures=True)
+
+    # final scores and proved flags of all sessions of a point, as a (2, sessions) array
+    def load(self, bot, portfolio_size, decisions):
+        return np.concatenate([np.load(self.path(c)) for c in self.chunks[(bot, portfolio_size, decisions)]], axis=1)
+
+    # final scores of all sessions of a point
+    def scores(self, bot, portfolio_size, decisions):
+        return self.load(bot, portfolio_size, decisions)[0]
+
+    # one row per bot and configuration with the win probability (and its
+    # standard error), the score distribution and the share of sessions whose
+    # score is not proved (optimal bot sessions stopped by the node budget)
+    def results(self):
+        rows = []
+        for bot in self.bots:
+            for c in self.configurations:
+                scores, proved = self.load(bot, c['portfolio_size'], c['decisions'])
+                finite = scores[np.isfinite(scores)]
+                p = float(np.mean(scores > c['winning_score']))
+                row = {'bot': bot, **c, 'sessions': scores.size, 'win_probability': p,
+                       'win_probability_se': float(np.sqrt(p * (1 - p) / scores.size)),
+                       'unproved': float(np.mean(proved == 0)),
+                       'mean': float(finite.mean()) if finite.size else np.nan}
+                for q, value in zip(QUANTILES, np.percentile(finite, QUANTILES) if finite.size else [np.nan] * 5):
+                    row['p{}'.format(q)] = float(value)
+                rows.append(row)
+        return rows
+
+
+# win probability table: a row per bot and configuration without the winning
+# score, a column per winning score
+def win_table(rows):
+    scores = sorted({r['winning_score'] for r in rows})
+    keys = ('bot', 'portfolio_size', 'new_loan_limit', 'duration', 'decisions')
+    table = {}
+    for r in rows:
+        table.setdefault(tuple(r[k] for k in keys), {})[r['winning_score']] = r['win_probability']
+    lines = ['{:<8} {:>5} {:>6} {:>8} {:>9}'.format('bot', 'size', 'deals', 'duration', 'decisions')
+             + ''.join('{:>9}'.format('>' + str(w)) for w in scores)]
+    for key, values in table.items():
+        lines.append('{:<8} {:>5} {:>6} {:>8} {:>9}'.format(*(str(k) for k in key))
+                     + ''.join('{:>9.3f}'.format(values[w]) for w in scores))
+    return '\n'.join(lines)
+
+
+# score distribution table: a row per bot and (portfolio size, decisions) point,
+# with the share of sessions whose score is only a lower bound
+def score_table(rows):
+    lines = ['{:<8} {:>5} {:>9} {:>9}'.format('bot', 'size', 'decisions', 'mean')
+             + ''.join('{:>9}'.format('p{}'.format(q)) for q in QUANTILES) + '{:>9}'.format('unproved')]
+    seen = set()
+    for r in rows:
+        key = (r['bot'], r['portfolio_size'], r['decisions'])
+        if key in seen:
+            continue
+        seen.add(key)
+        lines.append('{:<8} {:>5} {:>9} {:>9.1f}'.format(*key, r['mean'])
+                     + ''.join('{:>9.1f}'.format(r['p{}'.format(q)]) for q in QUANTILES)
+                     + '{:>9.3f}'.format(r['unproved']))
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Calibrate the Credit Detox difficulty with simulated sessions')
+    parser.add_argument('--config', default='configuration.yml')
+    parser.add_argument('--portfolio-size', type=int, nargs='+')
+    parser.add_argument('--new-loan-limit', type=int, nargs='+')
+    parser.add_argument('--duration', type=float, nargs='+')
+    parser.add_argument('--winning-score', type=float, nargs='+')
+    parser.add_argument('--bots', nargs='+', choices=BOTS, default=['greedy', 'optimal'])
+    parser.add_argument('--sessions', type=int, default=1000, help='sessions per bot and configuration')
+    parser.add_argument('--chunk', type=int, default=250, help='sessions per task (and cache file)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--nodes', type=int, default=NODES, help='solver nodes per session of the optimal bot')
+    parser.add_argument('--think', type=float, default=THINK, help='seconds a player needs per proposal')
+    parser.add_argument('--cache', default='calibration', help='directory of the cached chunk results')
+    parser.add_argument('--processes', type=int, default=None, help='process pool size (default: every core)')
+    parser.add_argument('--output', default=None, help='CSV file for the result rows')
+    args = parser.parse_args(argv)
+
+    grid = {name: getattr(args, name) for name in PARAMETERS}
+    sweep = Sweep(grid, args.bots, args.sessions, args.chunk, args.seed, args.think, args.cache,
+                  appconfig.load_config(args.config), args.nodes)
+    total = sum(len(chunks) for chunks in sweep.chunks.values())
+    print('{} configurations, {} of {} chunks cached'.format(
+        len(sweep.configurations), total - len(sweep.missing()), total))
+    try:
+        sweep.run(args.processes, lambda done, todo: print('\r{}/{} chunks'.format(done, todo), end='', flush=True))
+    except KeyboardInterrupt:
+        print('\ninterrupted, finished chunks are cached, run again to resume')
+        return 1
+    print()
+    rows = sweep.results()
+    print('win probability\n' + win_table(rows))
+    print('\nfinal score\n' + score_table(rows))
+    if args.output:
+        with open(args.output, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=list(rows[0]))
+            writer.writeheader()
+            writer.writerows(rows)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
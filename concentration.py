@@ -0,0 +1,163 @@
+# encoding: utf-8
+
+# (c) 2014-2024 Open Risk, all rights reserved
+#
+# FuriousBanker is licensed under the MIT license a copy of which is included
+# in the source distribution of FuriousBanker. This is notwithstanding any licenses of
+# third-party software included in this distribution. You may not use this file except in
+# compliance with the License.
+#
+# Unless required by applicable law or agreed to in writing, software distributed under
+# the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND,
+# either express or implied. See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import numpy as np
+
+import calculator
+
+
+# Array based concentration indices
+#
+# The indices follow the definitions (and defaults) of concentrationMetrics.Index
+# but work on the last axis of an array, so a 2-D array of shape (portfolios, loans)
+# is scored in one call. Rows are normalized to weights once and the weights, their
+# entropy terms and their descending sort are shared by all indices.
+
+# the portfolio values a concentration index is computed on
+def values(portfolio, by='exp'):
+    p = calculator.as_portfolio(portfolio)
+    if by == 'exp':
+        return p.exp
+    if by == 'el':
+        return p.el * p.exp
+    raise ValueError('by must be exp or el')
+
+
+# normalize the last axis to weights (shares of the row total)
+def weights(data):
+    data = np.asarray(data, dtype=np.float64)
+    if (data < 0).any():
+        raise ValueError('Input data vector must have positive values')
+    total = data.sum(axis=-1, keepdims=True)
+    if not (total > 0).all():
+        raise ValueError('Input data vector must have some non-zero values')
+    return data / total
+
+
+def _xlogx(w):
+    return w * np.log(np.where(w > 0, w, 1.0))
+
+
+def _hhi(w, normalized):
+    h = np.square(w).sum(axis=-1)
+    if normalized:
+        n = w.shape[-1]
+        return (h - 1.0 / n) / (1.0 - 1.0 / n)
+    return h
+
+
+def _gini(w_desc):
+    n = w_desc.shape[-1]
+    i = np.arange(1, n + 1)
+    return 1.0 + (1.0 - 2.0 * (i * w_desc).sum(axis=-1)) / n
+
+
+def _theil(w, entropy_terms):
+    return np.log(np.count_nonzero(w, axis=-1)) + entropy_terms.sum(axis=-1)
+
+
+def _shannon(w, entropy_terms, normalized):
+    h = -entropy_terms.sum(axis=-1)
+    if normalized:
+        return 1.0 - h / np.log(np.count_nonzero(w, axis=-1))
+    return h
+
+
+def _hannah_kay(w, entropy_terms, alpha):
+    if alpha <= 0:
+        raise ValueError('Alpha must be strictly positive')
+    if alpha == 1:
+        return np.exp(entropy_terms.sum(axis=-1))
+    return np.power(np.power(w, alpha).sum(axis=-1), 1.0 / (alpha - 1.0))
+
+
+def _cr(w_desc, n):
+    if n < 0 or n > w_desc.shape[-1]:
+        raise ValueError('n must be an positive integer smaller than the data size')
+    return w_desc[..., :n].sum(axis=-1)
+
+
+# Herfindahl-Hirschman index
+def hhi(data, normalized=True):
+    return _hhi(weights(data), normalized)
+
+
+# Gini index
+def gini(data):
+    return _gini(-np.sort(-weights(data), axis=-1))
+
+
+# Theil index (generalized entropy index with alpha = 1)
+def theil(data):
+    w = weights(data)
+    return _theil(w, _xlogx(w))
+
+
+# Shannon entropy index
+def shannon(data, normalized=False):
+    w = weights(data)
+    return _shannon(w, _xlogx(w), normalized)
+
+
+# inverted Hannah-Kay index
+def hannah_kay(data, alpha):
+    w = weights(data)
+    return _hannah_kay(w, _xlogx(w), alpha)
+
+
+# concentration ratio: the share of the n largest entries
+def concentration_ratio(data, n):
+    return _cr(-np.sort(-weights(data), axis=-1), n)
+
+
+# all indices in one pass, as a dict of arrays (one value per row)
+def indices(data, alpha=2, n=5, normalized=False):
+    w = weights(data)
+    w_desc = -np.sort(-w, axis=-1)
+    entropy_terms = _xlogx(w)
+    return {
+        'hhi': _hhi(w, normalized),
+        'gini': _gini(w_desc),
+        'theil': _theil(w, entropy_terms),
+        'shannon': _shannon(w, entropy_terms, normalized),
+        'hannah_kay': _hannah_kay(w, entropy_terms, alpha),
+        'cr': _cr(w_desc, min(n, w.shape[-1])),
+    }
+
+
+# compare indices() with concentrationMetrics row by row, returns the largest
+# absolute difference per index (raises AssertionError beyond the tolerance)
+def cross_check(data, alpha=2, n=5, normalized=False, atol=1e-9):
+    import concentrationMetrics as cm
+
+    data = np.atleast_2d(np.asarray(data, dtype=np.float64))
+    n = min(n, data.shape[-1])
+    result = indices(data, alpha, n, normalized)
+    index = cm.Index()
+    reference = {
+        'hhi': lambda row: index.hhi(row, normalized=normalized),
+        'gini': index.gini,
+        'theil': index.theil,
+        'shannon': lambda row: index.shannon(row, normalized=normalized),
+        'hannah_kay': lambda row: index.hk(row, alpha),
+        'cr': lambda row: index.cr(row, n),
+    }
+    differences = {}
+    for name, function in reference.items():
+        expected = np.array([function(row) for row in data])
+        differences[name] = float(np.max(np.abs(result[name] - expected)))
+        if differences[name] > atol:
+            raise AssertionError('{} differs from concentrationMetrics by {}'.format(name, differences[name]))
+    return differences
@@ -0,0 +1,153 @@
+# encoding: utf-8
+
+# (c) 2014-2024 Open Risk, all rights reserved
+#
+# FuriousBanker is licensed under the MIT license a copy of which is included
+# in the source distribution of FuriousBanker. This is notwithstanding any licenses of
+# third-party software included in this distribution. You may not use this file except in
+# compliance with the License.
+#
+# Unless required by applicable law or agreed to in writing, software distributed under
+# the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND,
+# either express or implied. See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import math
+
+import numpy as np
+
+import calculator
+
+
+# Multi-period portfolio dynamics
+#
+# Every period (dt years) each loan defaults with the probability implied by its
+# expected loss (pd = el / lgd per year), losing lgd * exp and leaving its slot
+# empty (exp 0), the surviving exposures amortize at a common annual rate and
+# the credit spreads follow a random walk with drift (uniform steps with the
+# given volatility, a normal draw costs about four times more). All loans move
+# at once with array operations on the portfolio, and the running sums of the
+# calculator.Metrics are updated without a full recompute: amortization scales
+# them, defaults subtract the contributions of the defaulted loans only and the
+# spread moves change the margin sum alone.
+class Dynamics:
+
+    def __init__(self, metrics, dt=1 / 12, amortization=0.2, spread_drift=0.0, spread_vol=0.005, lgd=0.45,
+                 seed=None, recompute_every=100):
+        self.metrics = metrics
+        self.dt = dt
+        self.amortization = amortization
+        self.spread_drift = spread_drift
+        self.spread_vol = spread_vol
+        self.lgd = lgd
+        self.rng = np.random.default_rng(seed)
+        self.recompute_every = recompute_every
+        self.periods = 0
+        self.losses = 0.0
+        self.defaults = 0
+        n = len(metrics.portfolio)
+        self._u = np.empty(n)
+        self._z = np.empty(n)
+        self._pd = np.empty(n)
+        # the el the period default probabilities were computed for
+        self._el = None
+
+    # probability of default within a period, 1 - (1 - el / lgd)^dt, computed
+    # again only when a loan was replaced
+    def default_probability(self):
+        p = self.metrics.portfolio
+        if self._el is None or not np.array_equal(self._el, p.el):
+            pd = self._pd
+            np.divide(p.el, self.lgd, out=pd)
+            np.clip(pd, 0.0, 1.0, out=pd)
+            np.negative(pd, out=pd)
+            with np.errstate(divide='ignore'):
+                np.log1p(pd, out=pd)
+            pd *= self.dt
+            np.expm1(pd, out=pd)
+            np.negative(pd, out=pd)
+            self._el = p.el.copy()
+        return self._pd
+
+    # advance one period, returns the slots of the loans that defaulted
+    def step(self):
+        m = self.metrics
+        p = m.portfolio
+        u, z = self._u, self._z
+
+        # defaults, exp > 0 excludes empty slots
+        self.rng.random(out=u)
+        defaulted = np.flatnonzero((u < self.default_probability()) & (p.exp > 0))
+        if defaulted.size:
+            total, margin, el_sum, el_sq_sum = calculator.sums(p.el[defaulted], p.s[defaulted], p.exp[defaulted])
+            m.total -= total
+            m.margin -= margin
+            m.el_sum -= el_sum
+            m.el_sq_sum -= el_sq_sum
+            self.losses += self.lgd * float(total)
+            self.defaults += defaulted.size
+            p.exp[defaulted] = 0.0
+
+        # amortization
+        f = (1.0 - self.amortization) ** self.dt
+        p.exp *= f
+        m.total *= f
+        m.margin *= f
+        m.el_sum *= f
+        m.el_sq_sum *= f * f
+        # the loans outside the portfolio amortize too
+        total, margin, el_sum, el_sq_sum = m.base
+        m.base = (f * total, f * margin, f * el_sum, f * f * el_sq_sum)
+
+        # spread random walk, kept within [0, 1]
+        if self.spread_vol or self.spread_drift:
+            # uniform on [-a, a] has standard deviation a / sqrt(3)
+            self.rng.random(out=z)
+            z *= 2 * math.sqrt(3) * self.spread_vol * math.sqrt(self.dt)
+            z += self.spread_drift * self.dt - math.sqrt(3) * self.spread_vol * math.sqrt(self.dt)
+            z += p.s
+            np.clip(z, 0.0, 1.0, out=z)
+            np.subtract(z, p.s, out=u)
+            m.margin += float(u @ p.exp)
+            p.s, self._z = z, p.s
+
+        self.periods += 1
+        if self.recompute_every and self.periods % self.recompute_every == 0:
+            m.recompute()
+        return defaulted
+
+    # advance to the period the game clock is in, period is the game time
+    # (seconds) of one period. Returns the number of periods stepped.
+    def advance(self, elapsed, period):
+        due = int(elapsed // period) - self.periods
+        for _ in range(due):
+            self.step()
+        return max(due, 0)
+
+    # step a number of periods and return the metrics after each as arrays
+    # (exposure, profitability, concentration, score, cumulative losses and
+    # defaults)
+    def run(self, periods):
+        m = self.metrics
+        result = {name: np.empty(periods) for name in ('exposure', 'profitability', 'concentration', 'score',
+                                                         'losses', 'defaults')}
+        for t in range(periods):
+            self.step()
+            with np.errstate(divide='ignore', invalid='ignore'):
+                exposure, profit, risk, score = calculator.metrics_from_sums(m.total, m.margin, m.el_sum,
+                                                                             m.el_sq_sum)
+            result['exposure'][t] = exposure
+            result['profitability'][t] = profit
+            result['concentration'][t] = risk
+            result['score'][t] = score
+            result['losses'][t] = self.losses
+            result['defaults'][t] = self.defaults
+        return result
+
+
+# fast-forward a copy of a portfolio through a number of periods headlessly,
+# returns the metrics after every period (see Dynamics.run)
+def fast_forward(portfolio, periods, seed=None, **parameters):
+    metrics = calculator.Metrics(calculator.as_portfolio(portfolio).copy())
+    return Dynamics(metrics, seed=seed, **parameters).run(periods)
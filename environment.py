@@ -0,0 +1,122 @@
+# encoding: utf-8
+
+# (c) 2014-2024 Open Risk, all rights reserved
+#
+# FuriousBanker is licensed under the MIT license a copy of which is included
+# in the source distribution of FuriousBanker. This is notwithstanding any licenses of
+# third-party software included in this distribution. You may not use this file except in
+# compliance with the License.
+#
+# Unless required by applicable law or agreed to in writing, software distributed under
+# the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND,
+# either express or implied. See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import numpy as np
+
+import calculator
+
+REJECT = -1
+
+
+# headless Credit Detox environment that advances n independent games in lockstep
+#
+# the rules follow Root: every proposal (accepted or rejected) uses up one of the
+# new_loan_limit deals, an accepted proposal replaces the loan in the chosen slot
+# and a game is won if its final score is above winning_score. There is no game
+# clock, an episode ends when the deals run out.
+#
+# actions are an integer array with one entry per game: REJECT (-1) rejects the
+# current proposal, a slot index in [0, portfolio_size) accepts it into that slot
+class CreditDetoxEnv:
+
+    def __init__(self, n_games, portfolio_size=12, new_loan_limit=100, winning_score=500, seed=None):
+        self.n_games = n_games
+        self.portfolio_size = portfolio_size
+        self.new_loan_limit = new_loan_limit
+        self.winning_score = winning_score
+        self.rng = np.random.default_rng(seed)
+        self.reset()
+
+    # start new games, returns the first observation
+    def reset(self, seed=None):
+        if seed is not None:
+            self.rng = np.random.default_rng(seed)
+        self.el, self.s, self.exp = calculator.init_loans((self.n_games, self.portfolio_size), self.rng)
+        self.total, self.margin, self.el_sum, self.el_sq_sum = calculator.sums(self.el, self.s, self.exp)
+        self.new_loan_count = 0
+        self._draw_proposals()
+        self.score = self._score()
+        return self.observation()
+
+    # apply one action per game, returns (observation, reward, done, info)
+    # the reward is the change in game score, done is shared by all games
+    def step(self, actions):
+        if self.done:
+            raise RuntimeError('episode is over, call reset()')
+        actions = np.asarray(actions)
+        if actions.shape != (self.n_games,):
+            raise ValueError('expected one action per game')
+        if ((actions < REJECT) | (actions >= self.portfolio_size)).any():
+            raise ValueError('actions must be REJECT or a portfolio slot')
+
+        games = np.flatnonzero(actions != REJECT)
+        slots = actions[games]
+        new = calculator.loan_sums(self.new_el[games], self.new_s[games], self.new_exp[games])
+        old = calculator.loan_sums(self.el[games, slots], self.s[games, slots], self.exp[games, slots])
+        self.total[games] += new[0] - old[0]
+        self.margin[games] += new[1] - old[1]
+        self.el_sum[games] += new[2] - old[2]
+        self.el_sq_sum[games] += new[3] - old[3]
+        self.el[games, slots] = self.new_el[games]
+        self.s[games, slots] = self.new_s[games]
+        self.exp[games, slots] = self.new_exp[games]
+
+        self.new_loan_count += 1
+        self._draw_proposals()
+        score_p = self.score
+        self.score = self._score()
+        reward = np.nan_to_num(self.score - score_p, nan=0.0, posinf=0.0, neginf=0.0)
+        info = {'won': self.won} if self.done else {}
+        return self.observation(), reward, self.done, info
+
+    @property
+    def done(self):
+        return self.new_loan_count >= self.new_loan_limit
+
+    @property
+    def won(self):
+        return self.score > self.winning_score
+
+    # current state of all games as arrays with the games along the first axis
+    def observation(self):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return {
+                'el': self.el,
+                's': self.s,
+                'exp': self.exp,
+                'new_loan': np.stack([self.new_el, self.new_s, self.new_exp], axis=-1),
+                'new_loan_count': self.new_loan_count,
+                'profitability': calculator.profit_from_sums(self.total, self.margin),
+                'concentration': calculator.risky_hhi_from_sums(self.total, self.el_sum, self.el_sq_sum),
+                'score': self.score,
+                'exposures': calculator.exposure_from_sums(self.total),
+            }
+
+    def _draw_proposals(self):
+        self.new_el, self.new_s, self.new_exp = calculator.newloans(self.n_games, self.rng)
+
+    def _score(self):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return calculator.score_from_sums(self.total, self.margin, self.el_sum, self.el_sq_sum)
+
+
+# play full episodes with a policy mapping an observation to an actions array,
+# returns the final scores of all games
+def run_episodes(env, policy):
+    obs = env.reset()
+    done = False
+    while not done:
+        obs, _, done, _ = env.step(policy(obs))
+    return env.score
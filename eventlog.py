@@ -0,0 +1,278 @@
+# encoding: utf-8
+
+# (c) 2014-2024 Open Risk, all rights reserved
+#
+# FuriousBanker is licensed under the MIT license a copy of which is included
+# in the source distribution of FuriousBanker. This is notwithstanding any licenses of
+# third-party software included in this distribution. You may not use this file except in
+# compliance with the License.
+#
+# Unless required by applicable law or agreed to in writing, software distributed under
+# the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND,
+# either express or implied. See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import os
+import time
+
+import numpy as np
+
+import calculator
+
+# Append-only binary log of play sessions
+#
+# The file is a 16 byte header followed by fixed width little endian records, so
+# it can be memory mapped as a numpy structured array and scanned without
+# copying. Every session is a contiguous run of records: one LOAN record per slot
+# of the initial portfolio, then one ACCEPT or REJECT record per proposal the
+# player decided on. Loan values are stored in units of 1 / SCALE, which keeps
+# the two decimal game values exact, and time is the wall clock (epoch seconds).
+MAGIC = b'FBEVLOG\x01'
+HEADER = 16
+
+LOAN = 0
+ACCEPT = 1
+REJECT = 2
+
+SCALE = 10000
+
+RECORD = np.dtype([
+    ('time', '<f8'),
+    ('session', '<u4'),
+    ('slot', '<i4'),
+    ('el', '<u2'),
+    ('s', '<u2'),
+    ('exp', '<u2'),
+    ('kind', 'u1'),
+    ('reserved', 'u1'),
+])
+
+
+def _header():
+    return MAGIC + np.array([RECORD.itemsize, 0], dtype='<u4').tobytes()
+
+
+# the records of a log file as a read only memory map (empty if there are none),
+# an incomplete last record (e.g. after a crash) is ignored
+def read(path):
+    with open(path, 'rb') as f:
+        header = f.read(HEADER)
+    if header[:len(MAGIC)] != MAGIC or header != _header():
+        raise ValueError('{} is not an event log of this version'.format(path))
+    count = (os.path.getsize(path) - HEADER) // RECORD.itemsize
+    if count == 0:
+        return np.empty(0, dtype=RECORD)
+    return np.memmap(path, dtype=RECORD, mode='r', offset=HEADER, shape=(count,))
+
+
+# encode loans (el, s, exp arrays) as records of the given kind
+def encode(kind, session, slot, el, s, exp, t):
+    el, s, exp, slot, t = np.broadcast_arrays(el, s, exp, slot, t)
+    result = np.zeros(el.shape, dtype=RECORD)
+    result['time'] = t
+    result['session'] = session
+    result['slot'] = slot
+    result['kind'] = kind
+    for field, values in zip(('el', 's', 'exp'), (el, s, exp)):
+        result[field] = np.rint(np.asarray(values) * SCALE)
+    return result
+
+
+# session recorder, appends to the log file (created if it does not exist)
+#
+# records are written unbuffered as they happen, so a crash loses at most the
+# record being written. Sessions are numbered on from the last one in the file.
+class EventLog:
+
+    def __init__(self, path):
+        self.path = path
+        if not os.path.exists(path) or os.path.getsize(path) == 0:
+            with open(path, 'wb') as f:
+                f.write(_header())
+            self.session = 0
+        else:
+            existing = read(path)
+            self.session = int(existing['session'][-1]) + 1 if existing.size else 0
+            del existing
+            # drop an incomplete trailing record, appending after it would
+            # misalign every record that follows
+            os.truncate(path, HEADER + self.records_in_file() * RECORD.itemsize)
+        self.file = open(path, 'ab', buffering=0)
+        self.started = False
+
+    def records_in_file(self):
+        return (os.path.getsize(self.path) - HEADER) // RECORD.itemsize
+
+    def _write(self, data):
+        self.file.write(data.tobytes())
+
+    # start a new session with the initial portfolio
+    def start(self, portfolio, t=None):
+        p = calculator.as_portfolio(portfolio)
+        if self.started:
+            self.session += 1
+        self.started = True
+        t = time.time() if t is None else t
+        self._write(encode(LOAN, self.session, np.arange(len(p)), p.el, p.s, p.exp, t))
+
+    def accept(self, slot, loan, t=None):
+        self._write(encode(ACCEPT, self.session, slot, *loan, time.time() if t is None else t))
+
+    def reject(self, loan, t=None):
+        self._write(encode(REJECT, self.session, -1, *loan, time.time() if t is None else t))
+
+    # write a whole session in one go: the initial portfolio, the (3, n) array
+    # of proposals and the actions taken (a slot or environment.REJECT), with
+    # the time of every decision (defaults to now)
+    def record_session(self, portfolio, proposals, actions, times=None):
+        p = calculator.as_portfolio(portfolio)
+        if self.started:
+            self.session += 1
+        self.started = True
+        actions = np.asarray(actions)
+        t = np.full(actions.size, time.time()) if times is None else np.asarray(times, dtype=np.float64)
+        kind = np.where(actions < 0, REJECT, ACCEPT)
+        initial = encode(LOAN, self.session, np.arange(len(p)), p.el, p.s, p.exp, t[0] if t.size else time.time())
+        decisions = encode(kind, self.session, np.where(actions < 0, -1, actions), *proposals, t)
+        self._write(np.concatenate([initial, decisions]))
+
+    def close(self):
+        self.file.close()
+
+
+# consecutive slices of the records with whole sessions and about the given
+# number of records each (memory map slices, nothing is copied)
+def chunks(records, size=2 ** 20):
+    starts = np.r_[_session_starts(records['session'])[1:], records.size]
+    begin = 0
+    while begin < records.size:
+        end = int(starts[min(np.searchsorted(starts, begin + size), starts.size - 1)])
+        yield records[begin:end]
+        begin = end
+
+
+# index of the first record of every session
+def _session_starts(session):
+    if session.size == 0:
+        return np.empty(0, dtype=np.intp)
+    return np.flatnonzero(np.r_[True, session[1:] != session[:-1]])
+
+
+# metric trajectories of the recorded sessions, recomputed in one vectorized
+# pass: the loan each accepted proposal replaces is found by ordering the
+# records by slot within their session, and the running sums follow from a
+# cumulative sum of the per decision changes.
+#
+# the metric arrays have one entry per record, the value after the record was
+# applied (the initial LOAN records all carry the initial portfolio values)
+class Replay:
+
+    def __init__(self, records):
+        kind = np.asarray(records['kind'])
+        slot = np.asarray(records['slot'])
+        session = np.asarray(records['session']).astype(np.int64)
+        self.kind = kind
+        self.time = np.asarray(records['time'])
+        n = kind.size
+
+        starts = _session_starts(session)
+        self.sessions = session[starts]
+        self.starts = starts
+        self.ends = np.r_[starts[1:], n] - 1
+        # session number (0 based, in this replay) of every record
+        self.index = np.repeat(np.arange(starts.size), self.ends - starts + 1)
+
+        loans = [np.asarray(records[field]) / SCALE for field in ('el', 's', 'exp')]
+        contributions = np.stack(calculator.loan_sums(*loans))
+
+        # previous record of the session that wrote the same slot
+        writes = np.flatnonzero(kind != REJECT)
+        ordered = writes[np.lexsort((writes, slot[writes], self.index[writes]))]
+        same = (self.index[ordered[1:]] == self.index[ordered[:-1]]) & (slot[ordered[1:]] == slot[ordered[:-1]])
+        previous = np.full(n, -1)
+        previous[ordered[1:][same]] = ordered[:-1][same]
+        accepted = kind == ACCEPT
+        if (previous[accepted] < 0).any():
+            raise ValueError('accepted proposal into a slot without an initial loan')
+
+        # the initial sums are reduced per session as calculator.sums does and the
+        # decisions are added one at a time as Metrics.replace does, in a
+        # (sessions, steps) layout, so the replayed metrics round the same way
+        loan = kind == LOAN
+        sizes = np.bincount(self.index[loan], minlength=starts.size)
+        steps = self.ends - starts + 1 - sizes
+        position = np.arange(n) - (starts + sizes - 1)[self.index]
+        position[loan] = 0
+        running = np.zeros((4, starts.size, steps.max(initial=0) + 1))
+        for size in np.unique(sizes):
+            group = np.flatnonzero(sizes == size)
+            rows = starts[group][:, None] + np.arange(size)
+            running[:, group, 0] = calculator.sums(*(values[rows] for values in loans))
+        decided = np.flatnonzero(~loan)
+        replaced = np.flatnonzero(accepted[decided])
+        delta = np.where(kind[decided] == REJECT, 0.0, contributions[:, decided])
+        delta[:, replaced] -= contributions[:, previous[decided[replaced]]]
+        running[:, self.index[decided], position[decided]] = delta
+        np.cumsum(running, axis=2, out=running)
+        self.total, self.margin, self.el_sum, self.el_sq_sum = running[:, self.index, position]
+
+        # the records after which the whole portfolio is loaded: the last
+        # initial loan of every session and all decisions
+        self.initial = (starts + sizes - 1)[sizes > 0]
+        self.decisions = ~loan
+        self.decisions[self.initial] = True
+
+    def __len__(self):
+        return self.sessions.size
+
+    @property
+    def exposure(self):
+        return calculator.exposure_from_sums(self.total)
+
+    @property
+    def profitability(self):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return calculator.profit_from_sums(self.total, self.margin)
+
+    @property
+    def concentration(self):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return calculator.risky_hhi_from_sums(self.total, self.el_sum, self.el_sq_sum)
+
+    @property
+    def score(self):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return calculator.score_from_sums(self.total, self.margin, self.el_sum, self.el_sq_sum)
+
+    # seconds since the start of its session for every record
+    @property
+    def elapsed(self):
+        return self.time - self.time[self.starts][self.index]
+
+    @property
+    def final_score(self):
+        e = self.ends
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return calculator.score_from_sums(self.total[e], self.margin[e], self.el_sum[e], self.el_sq_sum[e])
+
+    # trajectory of the i-th session: the metrics of the initial portfolio and
+    # after every decision
+    def trajectory(self, i):
+        rows = np.flatnonzero(self.decisions[self.starts[i]:self.ends[i] + 1]) + self.starts[i]
+        total, margin, el_sum, el_sq_sum = self.total[rows], self.margin[rows], self.el_sum[rows], self.el_sq_sum[rows]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return {
+                'elapsed': self.time[rows] - self.time[self.starts[i]],
+                'kind': self.kind[rows],
+                'exposure': calculator.exposure_from_sums(total),
+                'profitability': calculator.profit_from_sums(total, margin),
+                'concentration': calculator.risky_hhi_from_sums(total, el_sum, el_sq_sum),
+                'score': calculator.score_from_sums(total, margin, el_sum, el_sq_sum),
+            }
+
+
+# replay a log file chunk by chunk, yields a Replay per chunk
+def replay(path, chunk=2 ** 20):
+    for part in chunks(read(path), chunk):
+        yield Replay(part)
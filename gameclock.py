@@ -0,0 +1,49 @@
+# encoding: utf-8
+
+# (c) 2014-2024 Open Risk, all rights reserved
+#
+# FuriousBanker is licensed under the MIT license a copy of which is included
+# in the source distribution of FuriousBanker. This is notwithstanding any licenses of
+# third-party software included in this distribution. You may not use this file except in
+# compliance with the License.
+#
+# Unless required by applicable law or agreed to in writing, software distributed under
+# the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND,
+# either express or implied. See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import time
+
+
+# game time keeping from a monotonic start timestamp
+#
+# elapsed and remaining time are computed on demand instead of being
+# accumulated tick by tick, so the display can be refreshed at any rate (or not
+# at all while the window is hidden) without the game time drifting
+class GameClock:
+
+    def __init__(self, duration, clock=time.monotonic):
+        self.duration = duration
+        self.clock = clock
+        self.started = clock()
+
+    def start(self):
+        self.started = self.clock()
+
+    def elapsed(self):
+        return min(self.duration, self.clock() - self.started)
+
+    def remaining(self):
+        return self.duration - self.elapsed()
+
+    @property
+    def expired(self):
+        return self.elapsed() >= self.duration
+
+    # seconds between display refreshes so that a progress bar of the given
+    # width advances by about one pixel per refresh, within the given limits
+    # (max_interval None for no upper limit)
+    def refresh_interval(self, pixels, min_interval, max_interval=None):
+        interval = max(min_interval, self.duration / max(1.0, pixels))
+        return interval if max_interval is None else min(max_interval, interval)
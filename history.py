@@ -0,0 +1,183 @@
+# encoding: utf-8
+
+# (c) 2014-2024 Open Risk, all rights reserved
+#
+# FuriousBanker is licensed under the MIT license a copy of which is included
+# in the source distribution of FuriousBanker. This is notwithstanding any licenses of
+# third-party software included in this distribution. You may not use this file except in
+# compliance with the License.
+#
+# Unless required by applicable law or agreed to in writing, software distributed under
+# the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND,
+# either express or implied. See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import calculator
+from environment import REJECT
+
+
+# Versioned portfolio of a play session
+#
+# Every decision is a version holding only what changed: the slot written (or
+# REJECT), the proposal decided on and the loan it replaced, and the running
+# sums of calculator.Metrics after it. Versions form a tree, deciding
+# differently after an undo starts a new branch and keeps the old one. Taking a
+# version is O(1) in time and memory whatever the portfolio size, and moving
+# between versions replays the changes on the path between them on the one live
+# portfolio. The running sums of the version reached are restored exactly, so
+# going back and forth does not drift.
+
+
+class Version:
+    __slots__ = ('id', 'parent', 'depth', 'slot', 'old', 'new', 'sums', 'children', 'redo')
+
+    def __init__(self, id, parent, depth, slot, old, new, sums):
+        self.id = id
+        self.parent = parent
+        self.depth = depth
+        self.slot = slot
+        self.old = old
+        self.new = new
+        self.sums = sums
+        self.children = []
+        # the child redo() moves to: the one created or visited last
+        self.redo = None
+
+    @property
+    def accepted(self):
+        return self.slot != REJECT
+
+    @property
+    def score(self):
+        return float(calculator.score_from_sums(*self.sums))
+
+
+class PortfolioHistory:
+
+    def __init__(self, metrics):
+        self.metrics = metrics
+        self.versions = [Version(0, None, 0, REJECT, None, None, self._sums())]
+        self.current = 0
+
+    def _sums(self):
+        m = self.metrics
+        return m.total, m.margin, m.el_sum, m.el_sq_sum
+
+    def _restore(self, version):
+        m = self.metrics
+        m.total, m.margin, m.el_sum, m.el_sq_sum = version.sums
+        self.current = version.id
+
+    def __len__(self):
+        return len(self.versions)
+
+    def __getitem__(self, i):
+        return self.versions[i]
+
+    @property
+    def version(self):
+        return self.versions[self.current]
+
+    # decide on the proposal loan (el, s, exp): accept it into slot, or REJECT
+    # it. Returns the new version.
+    def commit(self, slot, loan=None):
+        parent = self.version
+        old = None
+        new = None if loan is None else tuple(float(x) for x in loan)
+        if slot != REJECT:
+            p = self.metrics.portfolio
+            old = (float(p.el[slot]), float(p.s[slot]), float(p.exp[slot]))
+            self.metrics.replace(slot, *new)
+        version = Version(len(self.versions), parent.id, parent.depth + 1, slot, old, new, self._sums())
+        self.versions.append(version)
+        parent.children.append(version.id)
+        parent.redo = version.id
+        self.current = version.id
+        return version
+
+    # step back to the previous version, returns the version undone (None at the start)
+    def undo(self):
+        version = self.version
+        if version.parent is None:
+            return None
+        if version.accepted:
+            self.metrics.replace(version.slot, *version.old)
+        self._restore(self.versions[version.parent])
+        return version
+
+    # step forward along the last used branch, returns the version redone (None at the end)
+    def redo(self):
+        child = self.version.redo
+        if child is None:
+            return None
+        version = self.versions[child]
+        if version.accepted:
+            self.metrics.replace(version.slot, *version.new)
+        self._restore(version)
+        return version
+
+    # the versions from the root to version (default the current one)
+    def timeline(self, version=None):
+        i = self.current if version is None else version
+        path = []
+        while i is not None:
+            path.append(i)
+            i = self.versions[i].parent
+        return path[::-1]
+
+    # the versions to undo and to redo to get from version a to version b
+    def _path(self, a, b):
+        up, down = [], []
+        while self.versions[a].depth > self.versions[b].depth:
+            up.append(a)
+            a = self.versions[a].parent
+        while self.versions[b].depth > self.versions[a].depth:
+            down.append(b)
+            b = self.versions[b].parent
+        while a != b:
+            up.append(a)
+            down.append(b)
+            a, b = self.versions[a].parent, self.versions[b].parent
+        return up, down[::-1]
+
+    # move the live portfolio to any version, redo then follows its branch
+    def checkout(self, version):
+        up, down = self._path(self.current, version)
+        for _ in up:
+            self.undo()
+        for i in down:
+            self.version.redo = i
+            self.redo()
+        return self.version
+
+    # a copy of the portfolio at a version, the live portfolio is left as it is
+    def portfolio(self, version):
+        p = self.metrics.portfolio.copy()
+        up, down = self._path(self.current, version)
+        for i in up:
+            v = self.versions[i]
+            if v.accepted:
+                p.replace(v.slot, *v.old)
+        for i in down:
+            v = self.versions[i]
+            if v.accepted:
+                p.replace(v.slot, *v.new)
+        return p
+
+    # what if the decision of version had been to accept its proposal into slot
+    # (or REJECT it) and every later decision up to leaf (default the current version)
+    # had stayed the same: plays the alternative timeline as a new branch and
+    # returns its last version. The live portfolio stays at the current version.
+    def what_if(self, version, slot, leaf=None):
+        current = self.current
+        later = self.timeline(leaf)
+        later = later[later.index(version) + 1:]
+        self.checkout(self.versions[version].parent)
+        self.commit(slot, self.versions[version].new)
+        for i in later:
+            v = self.versions[i]
+            self.commit(v.slot, v.new)
+        result = self.version
+        self.checkout(current)
+        return result
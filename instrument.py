@@ -0,0 +1,206 @@
+# encoding: utf-8
+
+# (c) 2014-2024 Open Risk, all rights reserved
+#
+# FuriousBanker is licensed under the MIT license a copy of which is included
+# in the source distribution of FuriousBanker. This is notwithstanding any licenses of
+# third-party software included in this distribution. You may not use this file except in
+# compliance with the License.
+#
+# Unless required by applicable law or agreed to in writing, software distributed under
+# the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND,
+# either express or implied. See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import bisect
+import functools
+import inspect
+import json
+import os
+import sys
+import threading
+import time
+
+# instrumentation is switched on with FURIOUSBANKER_INSTRUMENT=1 (summary in the
+# log at game over), any other non empty value is taken as the path of a JSON
+# lines file every summary is also appended to. FURIOUSBANKER_METRICS_PORT
+# additionally serves the current values at http://127.0.0.1:<port>/metrics.
+#
+# When it is off, timed() returns the decorated function itself and nothing is
+# installed, so there is no overhead at all.
+ENABLED = os.environ.get('FURIOUSBANKER_INSTRUMENT', '')
+PORT = os.environ.get('FURIOUSBANKER_METRICS_PORT', '')
+
+# upper bucket bounds of the latency histograms, in ms
+BOUNDS = (0.05, 0.1, 0.2, 0.5, 1, 2, 5, 10, 16.7, 20, 33.3, 50, 100, 200, 500, 1000, float('inf'))
+
+
+# latency histogram with fixed buckets, percentiles are the upper bound of the
+# bucket they fall in
+class Histogram:
+
+    def __init__(self):
+        self.counts = [0] * len(BOUNDS)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, ms):
+        self.counts[bisect.bisect_left(BOUNDS, ms)] += 1
+        self.count += 1
+        self.total += ms
+        if ms > self.max:
+            self.max = ms
+
+    def percentile(self, q):
+        rank = q / 100 * self.count
+        seen = 0
+        for bound, n in zip(BOUNDS, self.counts):
+            seen += n
+            if seen >= rank and n:
+                return min(bound, self.max)
+        return 0.0
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'mean_ms': self.total / self.count if self.count else 0.0,
+            'p50_ms': self.percentile(50),
+            'p95_ms': self.percentile(95),
+            'p99_ms': self.percentile(99),
+            'max_ms': self.max,
+            'buckets': {str(b): n for b, n in zip(BOUNDS, self.counts) if n},
+        }
+
+
+histograms = {}
+counters = {}
+gauges = {}
+
+
+def observe(name, ms):
+    histogram = histograms.get(name)
+    if histogram is None:
+        histogram = histograms[name] = Histogram()
+    histogram.add(ms)
+
+
+# time every call of the decorated function (a no-op unless ENABLED)
+def timed(name):
+    def decorator(function):
+        if not ENABLED:
+            return function
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                observe(name, 1000 * (time.perf_counter() - start))
+
+        return wrapper
+
+    return decorator
+
+
+def _counted(name, function):
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        counters[name] = counters.get(name, 0) + 1
+        return function(*args, **kwargs)
+
+    return wrapper
+
+
+# count the calls of the functions, methods and properties of a module (only
+# calls made through the module attributes are seen)
+def count_calls(module):
+    prefix = module.__name__ + '.'
+    for name, member in list(vars(module).items()):
+        if inspect.isfunction(member) and member.__module__ == module.__name__:
+            setattr(module, name, _counted(prefix + name, member))
+        elif inspect.isclass(member) and member.__module__ == module.__name__:
+            for attribute, value in list(vars(member).items()):
+                key = '{}{}.{}'.format(prefix, name, attribute)
+                if isinstance(value, property) and value.fset is None:
+                    setattr(member, attribute, property(_counted(key, value.fget)))
+                elif inspect.isfunction(value) and not attribute.startswith('__'):
+                    setattr(member, attribute, _counted(key, value))
+
+
+# current values as a dict
+def snapshot():
+    return {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'histograms': {name: h.to_dict() for name, h in sorted(histograms.items())},
+        'counters': dict(sorted(counters.items())),
+        'gauges': dict(sorted(gauges.items())),
+    }
+
+
+# current values in the Prometheus text format
+def exposition():
+    lines = []
+    for name, h in sorted(histograms.items()):
+        metric = 'furiousbanker_{}_ms'.format(name.replace('.', '_').replace(' ', '_'))
+        seen = 0
+        for bound, n in zip(BOUNDS, h.counts):
+            seen += n
+            lines.append('{}_bucket{{le="{}"}} {}'.format(metric, '+Inf' if bound == float('inf') else bound, seen))
+        lines.append('{}_sum {}'.format(metric, h.total))
+        lines.append('{}_count {}'.format(metric, h.count))
+    for name, value in sorted(counters.items()):
+        lines.append('furiousbanker_calls_total{{function="{}"}} {}'.format(name, value))
+    for name, value in sorted(gauges.items()):
+        lines.append('furiousbanker_{} {}'.format(name, value))
+    return '\n'.join(lines) + '\n'
+
+
+# serve exposition() at /metrics on localhost from a daemon thread
+def serve(port):
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+
+        def do_GET(self):
+            if self.path != '/metrics':
+                self.send_error(404)
+                return
+            body = exposition().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', int(port)), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+# log the summary and optionally append it to the instrumentation file
+def report(log=None):
+    if not ENABLED:
+        return
+    values = snapshot()
+    lines = []
+    for name, h in values['histograms'].items():
+        lines.append('Instrument: {:<24} n={:<7} p50={:8.2f} p95={:8.2f} p99={:8.2f} max={:8.2f} ms'.format(
+            name, h['count'], h['p50_ms'], h['p95_ms'], h['p99_ms'], h['max_ms']))
+    for name, value in values['counters'].items():
+        lines.append('Instrument: {:<40} {:>9} calls'.format(name, value))
+    for name, value in values['gauges'].items():
+        lines.append('Instrument: {:<40} {:>9}'.format(name, value))
+    for line in lines:
+        if log is None:
+            print(line, file=sys.stderr)
+        else:
+            log(line)
+    if ENABLED != '1':
+        with open(ENABLED, 'a') as f:
+            f.write(json.dumps(values) + '\n')
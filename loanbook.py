@@ -0,0 +1,223 @@
+# encoding: utf-8
+
+# (c) 2014-2024 Open Risk, all rights reserved
+#
+# FuriousBanker is licensed under the MIT license a copy of which is included
+# in the source distribution of FuriousBanker. This is notwithstanding any licenses of
+# third-party software included in this distribution. You may not use this file except in
+# compliance with the License.
+#
+# Unless required by applicable law or agreed to in writing, software distributed under
+# the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND,
+# either express or implied. See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import os
+
+import numpy as np
+
+import calculator
+
+# Loan books from files
+#
+# A loan book is read chunk by chunk from a CSV file (pandas), a Parquet file
+# (pyarrow) or a binary cache, and only the el, s and exp columns are kept. The
+# cache is a 16 byte header followed by (el, s, exp) float64 records, it is
+# memory mapped so chunks are views of the file. Metrics are accumulated over
+# the chunks in a single pass with memory bounded by the chunk size.
+MAGIC = b'FBLOANS\x01'
+HEADER = 16
+
+COLUMNS = ('el', 's', 'exp')
+
+RECORD = np.dtype([('el', '<f8'), ('s', '<f8'), ('exp', '<f8')])
+
+
+def _header():
+    return MAGIC + np.array([RECORD.itemsize, 0], dtype='<u4').tobytes()
+
+
+def is_cache(path):
+    with open(path, 'rb') as f:
+        return f.read(HEADER) == _header()
+
+
+# the records of a cache file as a read only memory map
+def read_cache(path):
+    if not is_cache(path):
+        raise ValueError('{} is not a loan book cache of this version'.format(path))
+    count = (os.path.getsize(path) - HEADER) // RECORD.itemsize
+    if count == 0:
+        return np.empty(0, dtype=RECORD)
+    return np.memmap(path, dtype=RECORD, mode='r', offset=HEADER, shape=(count,))
+
+
+# columns maps el, s and exp to the column names of the file (the same names by default)
+def _names(columns):
+    columns = dict(columns or {})
+    return [columns.get(name, name) for name in COLUMNS]
+
+
+def _csv_chunks(path, chunk, names):
+    import pandas as pd
+
+    for frame in pd.read_csv(path, usecols=names, chunksize=chunk, dtype={name: np.float64 for name in names}):
+        yield tuple(frame[name].to_numpy() for name in names)
+
+
+def _parquet_chunks(path, chunk, names):
+    try:
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError('reading Parquet loan books needs pyarrow')
+
+    for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk, columns=names):
+        yield tuple(batch.column(name).to_numpy(zero_copy_only=False).astype(np.float64, copy=False)
+                    for name in names)
+
+
+def _cache_chunks(path, chunk):
+    records = read_cache(path)
+    for begin in range(0, records.size, chunk):
+        part = records[begin:begin + chunk]
+        yield part['el'], part['s'], part['exp']
+
+
+# the loans of a loan book as (el, s, exp) arrays of at most chunk loans,
+# the format follows from the file (a cache) or its extension
+def read_chunks(path, chunk=2 ** 18, columns=None):
+    if is_cache(path):
+        return _cache_chunks(path, chunk)
+    name = path.lower()
+    if name.endswith(('.parquet', '.pq')):
+        return _parquet_chunks(path, chunk, _names(columns))
+    if name.endswith(('.csv', '.csv.gz', '.csv.bz2', '.csv.zip', '.txt')):
+        return _csv_chunks(path, chunk, _names(columns))
+    raise ValueError('unknown loan book format: {}'.format(path))
+
+
+# running sums, loan count and the top exposures of a loan book, loans are
+# added chunk by chunk
+class BookMetrics:
+
+    def __init__(self, top=12):
+        self.top = top
+        self.count = 0
+        self.total = self.margin = self.el_sum = self.el_sq_sum = 0.0
+        # book position and (el, s, exp) of the largest exposures so far
+        self.top_index = np.empty(0, dtype=np.int64)
+        self.top_loans = np.empty((3, 0))
+
+    def add(self, el, s, exp):
+        el, s, exp = (np.asarray(x, dtype=np.float64) for x in (el, s, exp))
+        chunk_sums = calculator.sums(el, s, exp)
+        self.total += float(chunk_sums[0])
+        self.margin += float(chunk_sums[1])
+        self.el_sum += float(chunk_sums[2])
+        self.el_sq_sum += float(chunk_sums[3])
+        if self.top:
+            # candidates are the current top and the top of the chunk
+            keep = np.argpartition(-exp, self.top - 1)[:self.top] if exp.size > self.top else np.arange(exp.size)
+            index = np.r_[self.top_index, self.count + keep]
+            loans = np.concatenate([self.top_loans, np.stack([el[keep], s[keep], exp[keep]])], axis=1)
+            if index.size > self.top:
+                keep = np.argpartition(-loans[2], self.top - 1)[:self.top]
+                index, loans = index[keep], loans[:, keep]
+            self.top_index, self.top_loans = index, loans
+        self.count += exp.size
+
+    @property
+    def exposure(self):
+        return float(calculator.exposure_from_sums(self.total))
+
+    @property
+    def profit(self):
+        return float(calculator.profit_from_sums(self.total, self.margin))
+
+    @property
+    def risky_hhi(self):
+        return float(calculator.risky_hhi_from_sums(self.total, self.el_sum, self.el_sq_sum))
+
+    @property
+    def score(self):
+        return float(calculator.score_from_sums(self.total, self.margin, self.el_sum, self.el_sq_sum))
+
+    # the top exposures as a Portfolio, largest first
+    def portfolio(self):
+        order = np.lexsort((self.top_index, -self.top_loans[2]))
+        return calculator.Portfolio(*self.top_loans[:, order])
+
+    # book positions of the top exposures, largest first
+    def positions(self):
+        return self.top_index[np.lexsort((self.top_index, -self.top_loans[2]))]
+
+    # running sums of the loans outside the top exposures, with the exposures
+    # scaled by scale (as the top exposures are when played)
+    def residual(self, scale=1.0):
+        top = calculator.sums(*self.top_loans)
+        total, margin, el_sum, el_sq_sum = (b - float(t) for b, t in zip(
+            (self.total, self.margin, self.el_sum, self.el_sq_sum), top))
+        return scale * total, scale * margin, scale * el_sum, scale * scale * el_sq_sum
+
+
+# one pass over a loan book: its metrics and top exposures, and if cache is a
+# path the binary cache of the book is written on the way
+def scan(path, top=12, chunk=2 ** 18, columns=None, cache=None):
+    metrics = BookMetrics(top)
+    writer = None
+    if cache is not None:
+        temporary = cache + '.tmp'
+        writer = open(temporary, 'wb')
+        writer.write(_header())
+    try:
+        for el, s, exp in read_chunks(path, chunk, columns):
+            metrics.add(el, s, exp)
+            if writer is not None:
+                records = np.empty(exp.size, dtype=RECORD)
+                records['el'], records['s'], records['exp'] = el, s, exp
+                writer.write(records.tobytes())
+        if writer is not None:
+            writer.close()
+            os.replace(temporary, cache)
+    except BaseException:
+        # no partial cache is left behind
+        if writer is not None:
+            writer.close()
+            if os.path.exists(temporary):
+                os.remove(temporary)
+        raise
+    return metrics
+
+
+# the cache file used for a loan book: next to it with a .fbloans suffix
+def cache_path(path):
+    return path + '.fbloans'
+
+
+# metrics and top exposures of a loan book, through its binary cache (if
+# cache): the cache is built on the first call and rebuilt when the book is
+# newer. Where the cache cannot be written (a read only location) the book is
+# read without it.
+def summarize(path, top=12, chunk=2 ** 18, columns=None, cache=True):
+    if is_cache(path):
+        return scan(path, top, chunk)
+    if not cache:
+        return scan(path, top, chunk, columns)
+    cached = cache_path(path)
+    if os.path.exists(cached) and os.path.getmtime(cached) >= os.path.getmtime(path):
+        return scan(cached, top, chunk)
+    try:
+        return scan(path, top, chunk, columns, cached)
+    except OSError:
+        if not os.path.exists(path):
+            raise
+        return scan(path, top, chunk, columns)
+
+
+# the whole loan book as a Portfolio (needs memory for all loans)
+def load(path, chunk=2 ** 18, columns=None):
+    parts = list(read_chunks(path, chunk, columns))
+    if not parts:
+        return calculator.Portfolio([], [], [])
+    return calculator.Portfolio(*(np.concatenate(column) for column in zip(*parts)))
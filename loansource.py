@@ -0,0 +1,145 @@
+# encoding: utf-8
+
+# (c) 2014-2024 Open Risk, all rights reserved
+#
+# FuriousBanker is licensed under the MIT license a copy of which is included
+# in the source distribution of FuriousBanker. This is notwithstanding any licenses of
+# third-party software included in this distribution. You may not use this file except in
+# compliance with the License.
+#
+# Unless required by applicable law or agreed to in writing, software distributed under
+# the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND,
+# either express or implied. See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import queue
+import threading
+
+import numpy as np
+
+import calculator
+
+
+# independent generators for the initial portfolio and the proposal stream of
+# successive play sessions, all derived from one root seed (random if None).
+# scenario_seed is the seed of the loss scenarios of the current session: the
+# same scenarios are simulated all session long, so the simulated metrics only
+# move with the portfolio.
+class SessionSeeder:
+
+    def __init__(self, seed=None):
+        self.seed_sequence = np.random.SeedSequence(seed)
+        self.scenario_seed = None
+
+    # generators of the next session as (portfolio_rng, loan_rng)
+    def next(self):
+        session_seed = self.seed_sequence.spawn(1)[0]
+        portfolio_seed, loan_seed, scenario_seed = session_seed.spawn(3)
+        self.scenario_seed = int(scenario_seed.generate_state(1)[0])
+        return np.random.default_rng(portfolio_seed), np.random.default_rng(loan_seed)
+
+
+# stream of new loan proposals served from pre-generated blocks
+#
+# subclasses implement _generate, returning the next block as a (3, k) array of
+# (el, s, exp) rows or None when the source is exhausted. With prefetch the next
+# block is produced on a background thread while the current one is consumed,
+# so next() only waits if proposals are drawn faster than blocks are produced.
+class LoanSource:
+
+    def __init__(self, prefetch=False):
+        self._block = np.empty((3, 0))
+        self._pos = 0
+        self._exhausted = False
+        self._queue = None
+        self._stop = None
+        if prefetch:
+            self._queue = queue.Queue(maxsize=1)
+            self._stop = threading.Event()
+            threading.Thread(target=self._produce, daemon=True).start()
+
+    def _generate(self):
+        raise NotImplementedError
+
+    def _produce(self):
+        while not self._stop.is_set():
+            block = self._generate()
+            self._queue.put(block)
+            if block is None:
+                return
+
+    def _next_block(self):
+        if self._exhausted:
+            return False
+        block = self._generate() if self._queue is None else self._queue.get()
+        if block is None:
+            self._exhausted = True
+            return False
+        self._block = block
+        self._pos = 0
+        return True
+
+    # next proposal as [el, s, exp], like calculator.newloan
+    def next(self):
+        if self._pos >= self._block.shape[1] and not self._next_block():
+            raise StopIteration
+        loan = self._block[:, self._pos]
+        self._pos += 1
+        return [float(x) for x in loan]
+
+    # next n proposals as a (3, n) array (fewer if the source runs out)
+    def draw(self, n):
+        parts = []
+        while n > 0:
+            if self._pos >= self._block.shape[1] and not self._next_block():
+                break
+            part = self._block[:, self._pos:self._pos + n]
+            self._pos += part.shape[1]
+            n -= part.shape[1]
+            parts.append(part)
+        return np.concatenate(parts, axis=1) if parts else np.empty((3, 0))
+
+    # stop the prefetch thread
+    def close(self):
+        if self._stop is not None:
+            self._stop.set()
+            # unblock a producer waiting on a full queue
+            try:
+                self._queue.get_nowait()
+            except queue.Empty:
+                pass
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return self.next()
+
+
+# random proposals with the calculator.newloan distribution
+class RandomLoanSource(LoanSource):
+
+    def __init__(self, seed=None, block_size=1024, prefetch=False):
+        self.rng = np.random.default_rng(seed)
+        self.block_size = block_size
+        super(RandomLoanSource, self).__init__(prefetch)
+
+    def _generate(self):
+        return np.stack(calculator.newloans(self.block_size, self.rng))
+
+
+# replay of a recorded proposal sequence, given as (el, s, exp) triples
+class ReplayLoanSource(LoanSource):
+
+    def __init__(self, loans, cycle=False, prefetch=False):
+        self.loans = np.array(loans, dtype=np.float64).reshape(-1, 3).T.copy()
+        self.cycle = cycle
+        self._served = False
+        super(ReplayLoanSource, self).__init__(prefetch)
+
+    def _generate(self):
+        if (self._served and not self.cycle) or self.loans.shape[1] == 0:
+            return None
+        self._served = True
+        return self.loans
@@ -0,0 +1,183 @@
+# encoding: utf-8
+
+# (c) 2014-2024 Open Risk, all rights reserved
+#
+# FuriousBanker is licensed under the MIT license a copy of which is included
+# in the source distribution of FuriousBanker. This is notwithstanding any licenses of
+# third-party software included in this distribution. You may not use this file except in
+# compliance with the License.
+#
+# Unless required by applicable law or agreed to in writing, software distributed under
+# the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND,
+# either express or implied. See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from scipy.special import ndtr, ndtri
+
+import calculator
+
+
+# number of distinct pds above which the conditional default probabilities are
+# gathered per loan instead of compared level by level
+GATHER_LEVELS = 64
+
+
+# Monte Carlo portfolio credit loss simulation with the one factor Gaussian copula
+# (Vasicek) model
+#
+# A loan defaults when sqrt(rho) * Z + sqrt(1 - rho) * e < ndtri(pd), with Z the
+# common systematic factor and e its idiosyncratic factor, and then loses lgd * exp.
+# The probability of default is implied from the expected loss as pd = el / lgd.
+#
+# Conditional on Z the defaults are independent with probability
+# ndtr((ndtri(pd) - sqrt(rho) * Z) / sqrt(1 - rho)), which only depends on the loan
+# through its pd. The conditional probabilities are therefore computed once per
+# distinct pd (game and rated portfolios have few, loan books with continuous el
+# about one per loan) and each loan draws a single uniform variate per scenario.
+# Scenarios are simulated in chunks whose size is set by a memory budget covering
+# the per loan and the per pd arrays, chunks are spread over a process pool and
+# every chunk has its own seed, so results do not depend on the number of processes.
+class LossModel:
+
+    def __init__(self, portfolio, rho=0.2, lgd=0.45):
+        p = calculator.as_portfolio(portfolio)
+        if not 0 <= rho < 1:
+            raise ValueError('rho must be in [0, 1)')
+        pd = np.clip(p.el / lgd, 0.0, 1.0)
+        levels, pd_index = np.unique(pd, return_inverse=True)
+        # loans are simulated sorted by pd, so each pd level is a contiguous block
+        self.order = np.argsort(pd_index, kind='stable')
+        self.bounds = np.searchsorted(pd_index[self.order], np.arange(levels.size + 1))
+        # pd level of every loan, with many levels (loan books with continuous el)
+        self.level = pd_index[self.order] if levels.size > GATHER_LEVELS else None
+        self.thresholds = ndtri(levels)
+        self.weights = (lgd * p.exp[self.order]).astype(np.float32)
+        self.rho = rho
+        self.lgd = lgd
+        self.total = float(p.exp.sum())
+
+    def __len__(self):
+        return self.weights.size
+
+    @property
+    def levels(self):
+        return self.thresholds.size
+
+    # bytes held per scenario while a chunk is simulated: the draws and default
+    # indicators per loan, the conditional probabilities per pd level and the
+    # gathered probabilities per loan if there are many levels
+    @property
+    def bytes_per_scenario(self):
+        return BYTES_PER_DRAW * len(self) + BYTES_PER_LEVEL * self.levels + (0 if self.level is None else 4 * len(self))
+
+    # portfolio losses of a chunk of scenarios and the per loan default indicators
+    # (in pd order, as float32 0/1 values)
+    def simulate(self, scenarios, rng):
+        z = rng.standard_normal(scenarios)
+        # (thresholds - sqrt(rho) z) / sqrt(1 - rho) and its ndtr in one float32 buffer
+        conditional = np.empty((scenarios, self.levels), dtype=np.float32)
+        np.subtract((self.thresholds / math.sqrt(1 - self.rho)).astype(np.float32)[None, :],
+                    (math.sqrt(self.rho / (1 - self.rho)) * z).astype(np.float32)[:, None], out=conditional)
+        ndtr(conditional, out=conditional)
+        draws = rng.random((scenarios, len(self)), dtype=np.float32)
+        defaults = np.empty(draws.shape, dtype=bool)
+        if self.level is not None:
+            np.less(draws, np.take(conditional, self.level, axis=1), out=defaults)
+        else:
+            for k, (a, b) in enumerate(zip(self.bounds[:-1], self.bounds[1:])):
+                np.less(draws[:, a:b], conditional[:, k:k + 1], out=defaults[:, a:b])
+        # reuse the draws buffer for the indicators
+        np.copyto(draws, defaults)
+        return draws @ self.weights, draws
+
+    # per loan values in pd order back to portfolio order
+    def unsort(self, values):
+        result = np.empty_like(values)
+        result[self.order] = values
+        return result
+
+
+# bytes held per (scenario, loan) pair and per (scenario, pd level) pair while
+# a chunk is simulated
+BYTES_PER_DRAW = 5
+BYTES_PER_LEVEL = 4
+
+
+def _run_chunks(model, seeds, sizes, threshold):
+    results = []
+    for seed, size in zip(seeds, sizes):
+        losses, defaults = model.simulate(size, np.random.default_rng(seed))
+        if threshold is None:
+            results.append(losses.astype(np.float64))
+        else:
+            tail = losses >= threshold
+            results.append(defaults[tail].sum(axis=0, dtype=np.float64))
+        # free the indicators before the next chunk allocates its own
+        del defaults
+    return results
+
+
+class LossSimulation:
+
+    def __init__(self, model, scenarios, seed=None, processes=1, memory=64 * 2 ** 20):
+        self.model = model
+        self.scenarios = scenarios
+        self.processes = processes or os.cpu_count() or 1
+        chunk = max(1, memory // max(1, model.bytes_per_scenario))
+        self.chunk_sizes = [min(chunk, scenarios - start) for start in range(0, scenarios, chunk)]
+        self.seeds = np.random.SeedSequence(seed).spawn(len(self.chunk_sizes))
+        self.losses = np.concatenate(self._map(None))
+        self._sorted = np.sort(self.losses)
+        self._contributions = {}
+
+    # run all chunks, in process or spread over a pool, in chunk order
+    def _map(self, threshold):
+        if self.processes == 1 or len(self.seeds) == 1:
+            return _run_chunks(self.model, self.seeds, self.chunk_sizes, threshold)
+        batches = min(len(self.seeds), 4 * self.processes)
+        bounds = np.linspace(0, len(self.seeds), batches + 1).astype(int)
+        with ProcessPoolExecutor(self.processes) as executor:
+            futures = [executor.submit(_run_chunks, self.model, self.seeds[a:b], self.chunk_sizes[a:b], threshold)
+                       for a, b in zip(bounds[:-1], bounds[1:])]
+            return [r for f in futures for r in f.result()]
+
+    @property
+    def expected_loss(self):
+        return float(self.losses.mean())
+
+    # value at risk at confidence level alpha
+    def var(self, alpha=0.99):
+        return float(self._sorted[max(0, math.ceil(alpha * self.scenarios) - 1)])
+
+    # expected shortfall: the mean loss in the scenarios at or beyond the VaR
+    def es(self, alpha=0.99):
+        return float(self._sorted[self._sorted >= self.var(alpha)].mean())
+
+    # expected shortfall contribution of every loan, E[loss_i | L >= VaR], these
+    # add up to the expected shortfall. The tail scenarios are regenerated from the
+    # chunk seeds rather than storing every default indicator.
+    def contributions(self, alpha=0.99):
+        if alpha not in self._contributions:
+            threshold = self.var(alpha)
+            counts = np.sum(self._map(threshold), axis=0)
+            tail = np.count_nonzero(self.losses >= threshold)
+            self._contributions[alpha] = self.model.unsort(counts * self.model.weights.astype(np.float64) / tail)
+        return self._contributions[alpha]
+
+
+# simulate the loss distribution of a portfolio
+def simulate(portfolio, scenarios=100000, rho=0.2, lgd=0.45, seed=None, processes=1, memory=64 * 2 ** 20):
+    return LossSimulation(LossModel(portfolio, rho, lgd), scenarios, seed, processes, memory)
+
+
+# credit value at risk as a percentage of the portfolio exposure, the optional
+# game metric shown next to the score
+def credit_var(portfolio, alpha=0.99, scenarios=10000, rho=0.2, lgd=0.45, seed=None):
+    simulation = simulate(portfolio, scenarios, rho, lgd, seed)
+    return round(100 * simulation.var(alpha) / simulation.model.total, 2)
@@ -0,0 +1,235 @@
+# encoding: utf-8
+
+# (c) 2014-2024 Open Risk, all rights reserved
+#
+# FuriousBanker is licensed under the MIT license a copy of which is included
+# in the source distribution of FuriousBanker. This is notwithstanding any licenses of
+# third-party software included in this distribution. You may not use this file except in
+# compliance with the License.
+#
+# Unless required by applicable law or agreed to in writing, software distributed under
+# the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND,
+# either express or implied. See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import numpy as np
+import scipy.sparse as sp
+
+import calculator
+
+
+# Obligor group and sector aware concentration
+#
+# Every loan belongs to an obligor group (numbered 0 .. groups - 1) and every
+# group to a sector. Loans of the same group default together, loans of
+# different groups are correlated by sector_rho if the groups share a sector
+# plus the weight of the edge between the groups in a sparse connection graph.
+#
+# The risky HHI is sum(el exp^2) / (exposure sum(el exp)), which is a loss
+# variance over an expected loss for independent loans. The correlated HHI
+# replaces the numerator with the loss variance under the correlations above:
+# with x the sum of sqrt(el) exp per group, z the same per sector and C the
+# graph weights it is
+#
+#   (1 - sector_rho) x.x + sector_rho z.z + x.C.x
+#
+# which equals sum(el exp^2) when every loan is its own group and nothing is
+# correlated. It is kept up to date in constant time (plus the number of graph
+# neighbours of the two groups involved) when a loan is swapped.
+
+
+# sparse symmetric group correlation matrix with zero diagonal, from a networkx
+# graph on the group numbers (edge 'weight', default 1) or a scipy sparse matrix
+def correlation_matrix(graph, groups):
+    if graph is None:
+        return sp.csr_matrix((groups, groups))
+    if sp.issparse(graph):
+        matrix = sp.csr_matrix(graph, dtype=np.float64)
+        if matrix.shape != (groups, groups):
+            raise ValueError('the correlation matrix must be groups x groups')
+        matrix = matrix.maximum(matrix.T)
+    else:
+        edges = np.array([(u, v, w) for u, v, w in graph.edges(data='weight', default=1.0) if u != v],
+                         dtype=np.float64).reshape(-1, 3)
+        u, v = edges[:, 0].astype(np.intp), edges[:, 1].astype(np.intp)
+        if ((u < 0) | (u >= groups) | (v < 0) | (v >= groups)).any():
+            raise ValueError('graph nodes must be group numbers below {}'.format(groups))
+        matrix = sp.csr_matrix((np.r_[edges[:, 2], edges[:, 2]], (np.r_[u, v], np.r_[v, u])),
+                               shape=(groups, groups))
+    matrix.setdiag(0)
+    matrix.eliminate_zeros()
+    matrix.sort_indices()
+    if (np.abs(matrix.data) > 1).any():
+        raise ValueError('correlations must lie in [-1, 1]')
+    return matrix
+
+
+# the obligor universe: the sector of every group, the correlation between
+# groups of a sector and the connection graph between groups
+class Obligors:
+
+    def __init__(self, sectors, graph=None, sector_rho=0.0):
+        self.sectors = np.array(sectors, dtype=np.intp)
+        if self.sectors.ndim != 1 or (self.sectors < 0).any():
+            raise ValueError('sectors must be a one dimensional array of sector numbers')
+        if not 0 <= sector_rho <= 1:
+            raise ValueError('sector_rho must lie in [0, 1]')
+        self.sector_rho = float(sector_rho)
+        self.correlation = correlation_matrix(graph, self.sectors.size)
+
+    @property
+    def groups(self):
+        return self.sectors.size
+
+    @property
+    def sector_count(self):
+        return int(self.sectors.max(initial=-1)) + 1
+
+
+# random obligor universe: groups spread evenly over the sectors and a random
+# graph with about degree neighbours per group, all edges of weight rho
+def random_obligors(groups, sectors, degree=2, rho=0.2, sector_rho=0.1, rng=None):
+    import networkx as nx
+
+    rng = np.random.default_rng(rng)
+    graph = nx.gnm_random_graph(groups, groups * degree // 2, seed=int(rng.integers(2 ** 31)))
+    nx.set_edge_attributes(graph, rho, 'weight')
+    return Obligors(rng.integers(sectors, size=groups), graph, sector_rho)
+
+
+# random obligor group of each of the loans of the given shape
+def draw_groups(shape, obligors, rng=None):
+    rng = np.random.default_rng(rng)
+    return rng.integers(obligors.groups, size=shape)
+
+
+# running sums of a portfolio with the obligor group of every slot: the sums of
+# calculator.Metrics plus the per group and per sector exposures and risk sums
+# (sqrt(el) exp) that the group, sector and correlated indices are built from
+class GroupMetrics(calculator.Metrics):
+
+    def __init__(self, portfolio, groups, obligors, recompute_every=1000):
+        self.obligors = obligors
+        self.groups = np.array(groups, dtype=np.intp)
+        if self.groups.shape != (len(calculator.as_portfolio(portfolio)),):
+            raise ValueError('one group per loan is needed')
+        if ((self.groups < 0) | (self.groups >= obligors.groups)).any():
+            raise ValueError('groups must be below {}'.format(obligors.groups))
+        super(GroupMetrics, self).__init__(portfolio, recompute_every)
+
+    def recompute(self):
+        super(GroupMetrics, self).recompute()
+        p = self.portfolio
+        ob = self.obligors
+        risk = np.sqrt(p.el) * p.exp
+        self.group_exposure = np.bincount(self.groups, p.exp, minlength=ob.groups)
+        self.group_risk = np.bincount(self.groups, risk, minlength=ob.groups)
+        self.sector_exposure = np.bincount(ob.sectors, self.group_exposure, minlength=ob.sector_count)
+        self.sector_risk = np.bincount(ob.sectors, self.group_risk, minlength=ob.sector_count)
+        # correlation weighted risk of the graph neighbours of every group
+        self.neighbour_risk = ob.correlation @ self.group_risk
+        self.group_sq = float(self.group_exposure @ self.group_exposure)
+        self.sector_sq = float(self.sector_exposure @ self.sector_exposure)
+        self.group_risk_sq = float(self.group_risk @ self.group_risk)
+        self.sector_risk_sq = float(self.sector_risk @ self.sector_risk)
+        self.graph_risk_sq = float(self.group_risk @ self.neighbour_risk)
+
+    # add exposure and risk to group g
+    def _move(self, g, exposure, risk):
+        s = self.obligors.sectors[g]
+        self.group_sq += exposure * (2 * self.group_exposure[g] + exposure)
+        self.group_exposure[g] += exposure
+        self.sector_sq += exposure * (2 * self.sector_exposure[s] + exposure)
+        self.sector_exposure[s] += exposure
+        self.group_risk_sq += risk * (2 * self.group_risk[g] + risk)
+        self.sector_risk_sq += risk * (2 * self.sector_risk[s] + risk)
+        self.graph_risk_sq += 2 * risk * self.neighbour_risk[g]
+        self.group_risk[g] += risk
+        self.sector_risk[s] += risk
+        c = self.obligors.correlation
+        begin, end = c.indptr[g], c.indptr[g + 1]
+        self.neighbour_risk[c.indices[begin:end]] += risk * c.data[begin:end]
+
+    # replace the loan in slot i, the new loan belongs to group (by default the
+    # group of the loan it replaces)
+    def replace(self, i, el, s, exp, group=None):
+        p = self.portfolio
+        old = int(self.groups[i])
+        group = old if group is None else int(group)
+        if not 0 <= group < self.obligors.groups:
+            raise ValueError('group must be below {}'.format(self.obligors.groups))
+        self._move(old, -float(p.exp[i]), -float(np.sqrt(p.el[i]) * p.exp[i]))
+        self._move(group, float(exp), float(np.sqrt(el) * exp))
+        self.groups[i] = group
+        super(GroupMetrics, self).replace(i, el, s, exp)
+
+    # loss variance of the portfolio under the group, sector and graph correlations
+    @property
+    def correlated_sq_sum(self):
+        rho = self.obligors.sector_rho
+        return (1 - rho) * self.group_risk_sq + rho * self.sector_risk_sq + self.graph_risk_sq
+
+    # HHI of the group exposures
+    @property
+    def group_hhi(self):
+        return self.group_sq / self.total / self.total
+
+    # HHI of the sector exposures
+    @property
+    def sector_hhi(self):
+        return self.sector_sq / self.total / self.total
+
+    # the risky HHI with the loss variance under the correlations
+    @property
+    def correlated_hhi(self):
+        return float(calculator.risky_hhi_from_sums(self.total, self.el_sum, self.correlated_sq_sum))
+
+    # the game score with the correlated HHI as risk
+    @property
+    def correlated_score(self):
+        return float(calculator.score_from_sums(self.total, self.margin, self.el_sum, self.correlated_sq_sum))
+
+    # what-if analysis of a proposed loan of the given group: the correlated HHI
+    # the portfolio would have if the proposal replaced the loan in each slot,
+    # for all slots in one vectorized pass
+    def swap_correlated_hhi(self, el, s, exp, group):
+        p = self.portfolio
+        ob = self.obligors
+        rho = ob.sector_rho
+        g, h = self.groups, int(group)
+        sector, target = ob.sectors[g], ob.sectors[h]
+        # take the loan out of its group
+        out = -np.sqrt(p.el) * p.exp
+        group_risk_sq = self.group_risk_sq + out * (2 * self.group_risk[g] + out)
+        sector_risk_sq = self.sector_risk_sq + out * (2 * self.sector_risk[sector] + out)
+        graph_risk_sq = self.graph_risk_sq + 2 * out * self.neighbour_risk[g]
+        # and add the proposal to its group, the sums of that group have moved
+        # if it is the same group (sector) or a graph neighbour
+        new = np.sqrt(el) * exp
+        group_risk = self.group_risk[h] + np.where(g == h, out, 0.0)
+        sector_risk = self.sector_risk[target] + np.where(sector == target, out, 0.0)
+        neighbour_risk = self.neighbour_risk[h] + out * ob.correlation[h].toarray()[0][g]
+        group_risk_sq += new * (2 * group_risk + new)
+        sector_risk_sq += new * (2 * sector_risk + new)
+        graph_risk_sq += 2 * new * neighbour_risk
+        correlated = (1 - rho) * group_risk_sq + rho * sector_risk_sq + graph_risk_sq
+        loan = calculator.loan_sums(el, s, exp)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return calculator.risky_hhi_from_sums(self.total + loan[0] - p.exp,
+                                                  self.el_sum + loan[2] - p.el * p.exp, correlated)
+
+
+# HHI of the obligor group exposures of a portfolio
+def group_hhi(portfolio, groups, obligors):
+    return GroupMetrics(portfolio, groups, obligors).group_hhi
+
+
+# HHI of the sector exposures of a portfolio
+def sector_hhi(portfolio, groups, obligors):
+    return GroupMetrics(portfolio, groups, obligors).sector_hhi
+
+
+# risky HHI of a portfolio under the group, sector and graph correlations
+def correlated_hhi(portfolio, groups, obligors):
+    return GroupMetrics(portfolio, groups, obligors).correlated_hhi
@@ -0,0 +1,287 @@
+# encoding: utf-8
+
+# (c) 2014-2024 Open Risk, all rights reserved
+#
+# FuriousBanker is licensed under the MIT license a copy of which is included
+# in the source distribution of FuriousBanker. This is notwithstanding any licenses of
+# third-party software included in this distribution. You may not use this file except in
+# compliance with the License.
+#
+# Unless required by applicable law or agreed to in writing, software distributed under
+# the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND,
+# either express or implied. See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Multi-session Credit Detox game server
+#
+# Runs many concurrent sessions in one asyncio process with the rules of the
+# desktop game (see Root) and the configuration.yml parameters. Clients send one
+# JSON object per line and get one JSON object per line back, a request "id" is
+# echoed so requests can be pipelined:
+#
+#   {"op": "new"}                                  start a session
+#   {"op": "state", "session": 3}                  current state (with the portfolio)
+#   {"op": "accept", "session": 3, "slot": 5}      accept the proposal into slot 5
+#   {"op": "reject", "session": 3}                 reject the proposal
+#   {"op": "var", "session": 3}                    credit VaR of the portfolio
+#   {"op": "best", "session": 3}                   best score the session allows
+#   {"op": "close", "session": 3}                  end the session
+#
+# Sessions belong to the connection that started them and are dropped when it
+# closes. var and best run on a process pool and answer out of order.
+#
+#   python server.py --port 8765
+
+import argparse
+import asyncio
+import json
+import math
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import appconfig
+import calculator
+import loansource
+
+# longest accepted request line
+MAX_LINE = 2 ** 16
+
+
+# state of one session: the portfolio with its running sums, a copy of the
+# initial portfolio, the proposals of the whole session, drawn up front as
+# one (3, new_loan_limit + 1) array, and the seed of its loss scenarios
+class GameSession:
+    __slots__ = ('metrics', 'initial', 'proposals', 'scenario_seed', 'count', 'accepted', 'started')
+
+    def __init__(self, portfolio, proposals, scenario_seed=None):
+        self.metrics = calculator.Metrics(portfolio)
+        self.initial = portfolio.copy()
+        self.proposals = proposals
+        self.scenario_seed = scenario_seed
+        self.count = 0
+        self.accepted = 0
+        self.started = time.monotonic()
+
+
+def _credit_var(el, s, exp, scenarios, seed):
+    import montecarlo
+
+    return montecarlo.credit_var(calculator.Portfolio(el, s, exp), scenarios=scenarios, seed=seed)
+
+
+def _best_score(el, s, exp, proposals):
+    import solver
+
+    return solver.solve(calculator.Portfolio(el, s, exp), proposals).score
+
+
+class GameServer:
+
+    def __init__(self, config, processes=None):
+        self.config = config
+        self.seeder = loansource.SessionSeeder(config.seed)
+        self.sessions = {}
+        self.next_id = 0
+        self.processes = processes
+        self._executor = None
+
+    # process pool for the heavy metrics, started on first use
+    @property
+    def executor(self):
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(self.processes)
+        return self._executor
+
+    def new_session(self):
+        rng, loan_rng = self.seeder.next()
+        portfolio = calculator.init(self.config.portfolio_size, rng)
+        proposals = loansource.RandomLoanSource(loan_rng, self.config.new_loan_limit + 1).draw(
+            self.config.new_loan_limit + 1)
+        session_id = self.next_id
+        self.next_id += 1
+        self.sessions[session_id] = GameSession(portfolio, proposals, self.seeder.scenario_seed)
+        return session_id
+
+    def expired(self, session):
+        return time.monotonic() - session.started >= self.config.duration
+
+    def done(self, session):
+        return session.count >= self.config.new_loan_limit or self.expired(session)
+
+    def state(self, session, full=False):
+        m = session.metrics
+        with np.errstate(divide='ignore', invalid='ignore'):
+            exposure, profit, risk, score = calculator.metrics_from_sums(m.total, m.margin, m.el_sum, m.el_sq_sum)
+        result = {
+            'profitability': _number(profit),
+            'concentration': _number(risk),
+            'score': _number(score),
+            'exposures': _number(exposure),
+            'new_loan': session.proposals[:, session.count].tolist(),
+            'new_loan_count': session.count,
+            'time': min(self.config.duration, time.monotonic() - session.started),
+            'done': self.done(session),
+        }
+        result['won'] = result['score'] is not None and result['score'] > self.config.winning_score
+        if full:
+            p = m.portfolio
+            result['portfolio'] = np.stack([p.el, p.s, p.exp], axis=1).tolist()
+        return result
+
+    def accept(self, session, slot):
+        if not 0 <= slot < self.config.portfolio_size:
+            raise ValueError('slot out of range')
+        if not self.done(session):
+            session.metrics.replace(slot, *(float(x) for x in session.proposals[:, session.count]))
+            session.count += 1
+            session.accepted += 1
+
+    def reject(self, session):
+        if not self.done(session):
+            session.count += 1
+
+    # answer one request, owned are the sessions of the connection: a response
+    # dict, or for the heavy metrics a future of one
+    def handle(self, request, owned):
+        op = request.get('op')
+        if op == 'new':
+            session_id = self.new_session()
+            owned.add(session_id)
+            return {'session': session_id, **self.state(self.sessions[session_id], full=True)}
+        session_id = request.get('session')
+        if session_id not in owned:
+            raise ValueError('unknown session')
+        session = self.sessions[session_id]
+        if op == 'accept':
+            self.accept(session, int(request['slot']))
+            return self.state(session)
+        if op == 'reject':
+            self.reject(session)
+            return self.state(session)
+        if op == 'state':
+            return self.state(session, full=True)
+        if op == 'close':
+            owned.discard(session_id)
+            del self.sessions[session_id]
+            return {'closed': session_id}
+        if op == 'var':
+            p = session.metrics.portfolio
+            scenarios = int(request.get('scenarios') or self.config.loss_scenarios or 10000)
+            return self._offload('credit_var', _credit_var, p.el.copy(), p.s.copy(), p.exp.copy(), scenarios,
+                                 session.scenario_seed)
+        if op == 'best':
+            p = session.initial
+            return self._offload('best_score', _best_score, p.el, p.s, p.exp,
+                                 session.proposals[:, :self.config.new_loan_limit])
+        raise ValueError('unknown op: {}'.format(op))
+
+    async def _run(self, key, function, *args):
+        try:
+            return {key: await asyncio.get_running_loop().run_in_executor(self.executor, function, *args)}
+        except Exception as e:
+            return {'error': str(e)}
+
+    def _offload(self, key, function, *args):
+        return asyncio.ensure_future(self._run(key, function, *args))
+
+    # the encoded response to one request line, or None if it is answered later
+    # (through protocol.send)
+    def respond(self, line, protocol):
+        request = {}
+        try:
+            parsed = json.loads(line)
+            if not isinstance(parsed, dict):
+                raise ValueError('a request is a JSON object')
+            request = parsed
+            response = self.handle(request, protocol.owned)
+        except Exception as e:
+            # a bad request (e.g. a slot of 1e999, an OverflowError) must not
+            # close the connection and its sessions
+            response = {'error': str(e)}
+        if isinstance(response, asyncio.Future):
+            response.add_done_callback(lambda future: protocol.send(_encode(request, future.result())))
+            return None
+        return _encode(request, response)
+
+    async def serve(self, host='127.0.0.1', port=8765):
+        loop = asyncio.get_running_loop()
+        server = await loop.create_server(lambda: GameProtocol(self), host, port)
+        async with server:
+            await server.serve_forever()
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+
+
+def _encode(request, response):
+    if 'id' in request:
+        response['id'] = request['id']
+    return json.dumps(response).encode() + b'\n'
+
+
+# one client connection: requests are answered in the order they arrive and the
+# responses to everything received at once go out in a single write. Reading
+# pauses while the client does not take its responses.
+class GameProtocol(asyncio.Protocol):
+
+    def __init__(self, server):
+        self.server = server
+        self.owned = set()
+        self.transport = None
+        self._partial = b''
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def data_received(self, data):
+        lines = (self._partial + data).split(b'\n')
+        self._partial = lines.pop()
+        if len(self._partial) > MAX_LINE:
+            self.transport.close()
+            return
+        responses = [self.server.respond(line, self) for line in lines if line.strip()]
+        self.send(b''.join(r for r in responses if r is not None))
+
+    def send(self, data):
+        if data and not self.transport.is_closing():
+            self.transport.write(data)
+
+    def pause_writing(self):
+        self.transport.pause_reading()
+
+    def resume_writing(self):
+        self.transport.resume_reading()
+
+    def connection_lost(self, exc):
+        for session_id in self.owned:
+            self.server.sessions.pop(session_id, None)
+        self.owned.clear()
+
+
+# JSON has no nan / inf
+def _number(x):
+    x = float(x)
+    return x if math.isfinite(x) else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Credit Detox game server')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--config', default='configuration.yml')
+    parser.add_argument('--processes', type=int, default=None, help='process pool size for var and best')
+    args = parser.parse_args()
+    game_server = GameServer(appconfig.load_config(args.config), args.processes)
+    try:
+        asyncio.run(game_server.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        game_server.close()
+
+
+if __name__ == '__main__':
+    main()
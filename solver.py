@@ -0,0 +1,331 @@
+# encoding: utf-8
+
+# (c) 2014-2024 Open Risk, all rights reserved
+#
+# FuriousBanker is licensed under the MIT license a copy of which is included
+# in the source distribution of FuriousBanker. This is notwithstanding any licenses of
+# third-party software included in this distribution. You may not use this file except in
+# compliance with the License.
+#
+# Unless required by applicable law or agreed to in writing, software distributed under
+# the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND,
+# either express or implied. See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import calculator
+from environment import REJECT
+
+
+# Optimal play of a Credit Detox session
+#
+# An accepted proposal can replace any loan, including an earlier proposal, so
+# every portfolio_size subset of the pool (initial loans followed by the
+# proposals) is a reachable final portfolio, and the best session score is the
+# best score over these subsets. The accept / reject / slot policy reaching it
+# follows directly from the chosen subset (see actions).
+#
+# Leaving out the display rounding the score is 1000 * M * E / Q, with M, E, Q
+# the margin, el and el * exp sums of the portfolio. Since 4 c M E <= (M + c E)^2
+# for every c > 0, the score is bounded by 1000 (M + c E)^2 / (4 c Q), and this
+# bound is convex in the subset sums, so its maximum over all subsets is found
+# exactly among the vertices of their convex hull. The bound is tight for the
+# subset with M / E = c: iterating c -> M / E of the maximizing subset usually
+# finds the optimum in a few steps.
+#
+# The game displays 1000 P / round(R), with P = 100 M / T the profitability, R =
+# 100 Q / (T E) the risky HHI and T the exposure sum, and the rounding of R to an
+# integer moves the score by several percent, so the best displayed score can
+# come from another subset. A subset displays more than D only if 1000 P > D (R
+# - 0.5), that is E (M + D T / 200000) > D Q / 1000, which has the same form as
+# above with M + D T / 200000 in place of M (the exposures are in hundredths, so
+# T is not changed by its rounding). A depth first branch and bound with this
+# (hull) bound finds the subset with the best displayed score, starting from
+# the best subset of the iteration, spread over a process pool.
+
+# relative gap below which a solution is taken as optimal
+TOLERANCE = 1e-9
+
+
+# per loan contributions to the running sums (as in calculator.sums) of the
+# pool: the initial portfolio loans followed by the proposals, as a (4, n) array
+def pool_sums(portfolio, proposals):
+    p = calculator.as_portfolio(portfolio)
+    proposals = np.asarray(proposals, dtype=np.float64).reshape(3, -1)
+    el, s, exp = (np.concatenate([a, b]) for a, b in zip((p.el, p.s, p.exp), proposals))
+    return np.stack(calculator.loan_sums(el, s, exp))
+
+
+# game score before rounding
+def score_value(margin, el_sum, el_sq_sum):
+    return 1000 * margin * el_sum / el_sq_sum
+
+
+# the r candidates (a, q) maximizing max(0, a0 + sum a)^2 / (q0 + sum q), as
+# (value, candidate indices)
+#
+# the maximum of the convex objective is at a vertex of the hull of the subset
+# sums, i.e. it is reached by the r largest a - t q for some t >= 0. The
+# selection only changes where two candidates tie, so it suffices to try one t
+# between successive ties. Candidates beaten in both a and q by r others are
+# never needed and are dropped first.
+def hull_best(a, q, a0, q0, r):
+    if r == 0:
+        return max(a0, 0.0) ** 2 / q0, np.empty(0, dtype=np.intp)
+    dominated = (a >= a[:, None]) & (q <= q[:, None]) & ((a > a[:, None]) | (q < q[:, None]))
+    keep = np.flatnonzero(dominated.sum(axis=1) < r)
+    if keep.size <= r:
+        return max(a0 + a[keep].sum(), 0.0) ** 2 / (q0 + q[keep].sum()), keep
+    a, q = a[keep], q[keep]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ties = (a[:, None] - a[None, :]) / (q[:, None] - q[None, :])
+    ties = np.unique(ties[np.triu_indices(keep.size, 1)])
+    ties = ties[(ties > 0) & np.isfinite(ties)]
+    if ties.size:
+        t = np.concatenate([[ties[0] / 2], (ties[:-1] + ties[1:]) / 2, [2 * ties[-1]]])
+    else:
+        t = np.ones(1)
+    chosen = np.argpartition(t[:, None] * q[None, :] - a[None, :], r - 1, axis=1)[:, :r]
+    values = np.maximum(a0 + a[chosen].sum(axis=1), 0.0) ** 2 / (q0 + q[chosen].sum(axis=1))
+    best = int(np.argmax(values))
+    return float(values[best]), keep[chosen[best]]
+
+
+# upper bound on the score of every subset of the pool (plus the base sums),
+# with its maximizing subset
+def relaxation(pool, size, c, base):
+    value, chosen = hull_best(pool[1] + c * pool[2], pool[3], base[1] + c * base[2], base[3], size)
+    return 1000 * value / (4 * c), chosen
+
+
+# game score as displayed, -inf where it is undefined
+def displayed_score(sums):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        score = float(calculator.score_from_sums(*sums))
+    return score if not np.isnan(score) else -np.inf
+
+
+# best swaps of one chosen pool loan for one left out, while the displayed
+# score improves. Returns (score, chosen).
+def improve(pool, chosen, score, base):
+    chosen = np.array(chosen)
+    while True:
+        out = np.ones(pool.shape[1], dtype=bool)
+        out[chosen] = False
+        out = np.flatnonzero(out)
+        if out.size == 0:
+            return score, chosen
+        sums = base + pool[:, chosen].sum(axis=1)
+        swapped = sums[:, None, None] - pool[:, chosen, None] + pool[:, None, out]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            scores = calculator.score_from_sums(*swapped)
+        scores = np.where(np.isnan(scores), -np.inf, scores)
+        i, j = np.unravel_index(np.argmax(scores), scores.shape)
+        if not scores[i, j] > score:
+            return score, chosen
+        chosen[i], score = out[j], float(scores[i, j])
+
+
+# depth first branch and bound over the candidates (in the given order) for
+# the best displayed score, with the relaxation at a fixed c > 0 as node bound.
+# The search below a node starts from the decisions on the first k candidates
+# (chosen holds the accepted ones). Returns (score, chosen, complete), complete
+# is False if the deadline was hit or more than nodes nodes were expanded.
+def _search(pool, size, c, order, k, chosen, incumbent, deadline, nodes, base):
+    t, m, e, q = pool[:, order]
+    best = [incumbent, None]
+    complete = [True]
+    expanded = [0]
+
+    def branch(k, chosen, sums):
+        r = size - len(chosen)
+        if r == 0:
+            value = displayed_score(sums)
+            if value > best[0]:
+                best[0], best[1] = value, list(chosen)
+            return
+        if order.size - k < r:
+            return
+        expanded[0] += 1
+        if expanded[0] > nodes or time.perf_counter() > deadline:
+            complete[0] = False
+            return
+        if best[0] > -np.inf:
+            w = best[0] / 200000
+            a = m[k:] + w * t[k:] + c * e[k:]
+            a0 = sums[1] + w * sums[0] + c * sums[2]
+            limit = 4 * c * best[0] / 1000
+            # the r largest a over the r smallest q bound the hull, and are cheaper
+            top = -np.partition(-a, r - 1)[:r] if a.size > r else a
+            low = np.partition(q[k:], r - 1)[:r] if a.size > r else q[k:]
+            if max(a0 + top.sum(), 0.0) ** 2 / (sums[3] + low.sum()) <= limit:
+                return
+            if hull_best(a, q[k:], a0, sums[3], r)[0] <= limit:
+                return
+        branch(k + 1, chosen + [k], sums + pool[:, order[k]])
+        branch(k + 1, chosen, sums)
+
+    branch(k, list(chosen), base + pool[:, order[list(chosen)]].sum(axis=1))
+    if best[1] is None:
+        return best[0], None, complete[0]
+    return best[0], order[best[1]], complete[0]
+
+
+# best subset for the pool of a session: score is its displayed score, value
+# its score before rounding and bound an upper bound on the score before
+# rounding of every subset
+class Solution:
+
+    def __init__(self, pool, size, chosen, bound, optimal, proposals, base):
+        self.chosen = np.sort(chosen)
+        self.size = size
+        sums = base + pool[:, self.chosen].sum(axis=1)
+        self.value = float(score_value(*sums[1:]))
+        self.bound = max(float(bound), self.value)
+        self.optimal = optimal
+        self.proposals = proposals
+        # the score as the game displays it
+        with np.errstate(divide='ignore', invalid='ignore'):
+            self.score = float(calculator.score_from_sums(*sums))
+
+    @property
+    def gap(self):
+        return (self.bound - self.value) / abs(self.value) if self.value else np.inf
+
+    # the policy reaching the chosen portfolio: per proposal the slot it is
+    # accepted into or REJECT (slots of loans not kept are filled in order)
+    def actions(self):
+        kept = np.zeros(self.size + self.proposals, dtype=bool)
+        kept[self.chosen] = True
+        free = list(np.flatnonzero(~kept[:self.size]))
+        return np.array([free.pop(0) if keep else REJECT for keep in kept[self.size:]], dtype=np.intp)
+
+
+# best final portfolio of a session: the initial portfolio and the (3, n) array
+# of (el, s, exp) proposals it was offered (as from LoanSource.draw)
+#
+# the branch and bound stops at the deadline (time_limit seconds, None for no
+# limit) or after expanding nodes nodes (None for no limit, unlike the time
+# limit the result does not depend on the machine) with the best subset found
+# (optimal is then False). processes > 1 spreads the top of the search tree
+# over a process pool (None uses all cpus), each subtree gets an equal share of
+# the nodes.
+# base holds the running sums of loans that stay in the portfolio whatever is
+# played (as calculator.Metrics.base).
+def solve(portfolio, proposals, time_limit=1.0, processes=1, iterations=20, base=None, nodes=None):
+    deadline = np.inf if time_limit is None else time.perf_counter() + time_limit
+    nodes = np.inf if nodes is None else nodes
+    pool = pool_sums(portfolio, proposals)
+    base = np.zeros(4) if base is None else np.asarray(base, dtype=np.float64)
+    size = len(calculator.as_portfolio(portfolio))
+    n = pool.shape[1] - size
+
+    # fixed point iteration c -> M / E from the median ratio of the loans with
+    # a positive margin (c must stay positive), the incumbent is the best subset
+    # seen and the bound the smallest relaxation
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratios = pool[1] / pool[2]
+    ratios = ratios[np.isfinite(ratios) & (ratios > 0)]
+    c = float(np.median(ratios)) if ratios.size else 1.0
+    best = np.arange(size)
+    best_value, bound = score_value(*(base + pool[:, :size].sum(axis=1))[1:]), np.inf
+    for _ in range(iterations):
+        value, chosen = relaxation(pool, size, c, base)
+        bound = min(bound, value)
+        sums = base + pool[:, chosen].sum(axis=1)
+        if score_value(*sums[1:]) > best_value:
+            best, best_value = chosen, score_value(*sums[1:])
+        if bound - best_value <= TOLERANCE * abs(best_value):
+            break
+        c_next = sums[1] / sums[2]
+        if not c_next > 0 or abs(c_next - c) <= TOLERANCE * c:
+            break
+        c = c_next
+
+    # best displayed score, starting from the best swaps of the incumbent. The
+    # relaxation is tight at c = (M + D T / 200000) / E of the incumbent.
+    incumbent, best = improve(pool, best, displayed_score(base + pool[:, best].sum(axis=1)), base)
+    sums = base + pool[:, best].sum(axis=1)
+    c_next = (sums[1] + max(incumbent, 0.0) * sums[0] / 200000) / sums[2]
+    if c_next > 0:
+        c = c_next
+    order = np.argsort(-(pool[1] + c * pool[2]) / np.sqrt(pool[3]))
+    results = _branch(pool, size, c, order, incumbent, deadline, nodes, processes, base)
+    complete = True
+    for score, chosen, done in results:
+        complete = complete and done
+        if chosen is not None and score > incumbent:
+            best, incumbent = chosen, score
+    return Solution(pool, size, best, bound, complete, n, base)
+
+
+def _branch(pool, size, c, order, incumbent, deadline, nodes, processes, base):
+    processes = processes or os.cpu_count() or 1
+    if processes == 1:
+        return [_search(pool, size, c, order, 0, [], incumbent, deadline, nodes, base)]
+    # split on the first candidates until there is work for every process
+    subtrees = [(0, [])]
+    while len(subtrees) < 4 * processes and subtrees[0][0] < order.size:
+        k, chosen = subtrees.pop(0)
+        subtrees.extend((k + 1, branch) for branch in (chosen + [k], chosen) if len(branch) <= size)
+    with ProcessPoolExecutor(processes) as executor:
+        futures = [executor.submit(_search, pool, size, c, order, k, chosen, incumbent, deadline,
+                                   nodes / len(subtrees), base)
+                   for k, chosen in subtrees]
+        return [f.result() for f in futures]
+
+
+# benchmark bots, called as bot(portfolio, proposals, t) with the current
+# Portfolio and the proposals of the session, return the slot proposal t is
+# accepted into or REJECT
+
+# accept a proposal into the slot with the best score if that improves the score
+def greedy(portfolio, proposals, t):
+    _, _, result = calculator.swap_metrics(portfolio, *proposals[:, t])
+    slot = int(np.nanargmax(np.where(np.isnan(result), -np.inf, result)))
+    return slot if result[slot] > calculator.score(portfolio) else REJECT
+
+
+# plan the best portfolio from the current one and the next depth proposals,
+# and act on the current proposal accordingly
+class Lookahead:
+
+    def __init__(self, depth=10, time_limit=0.05):
+        self.depth = depth
+        self.time_limit = time_limit
+
+    def __call__(self, portfolio, proposals, t):
+        solution = solve(portfolio, proposals[:, t:t + self.depth], self.time_limit)
+        return int(solution.actions()[0])
+
+
+# play a session with a bot, returns the final game score and the actions
+def play(portfolio, proposals, bot):
+    p = calculator.as_portfolio(portfolio).copy()
+    proposals = np.asarray(proposals, dtype=np.float64).reshape(3, -1)
+    actions = np.empty(proposals.shape[1], dtype=np.intp)
+    for t in range(proposals.shape[1]):
+        actions[t] = bot(p, proposals, t)
+        if actions[t] != REJECT:
+            p.replace(actions[t], *proposals[:, t])
+    return calculator.score(p), actions
+
+
+# greedy policy for environment.CreditDetoxEnv, vectorized over the games
+def greedy_policy(obs):
+    totals = calculator.sums(obs['el'], obs['s'], obs['exp'])
+    old = calculator.loan_sums(obs['el'], obs['s'], obs['exp'])
+    new = calculator.loan_sums(*obs['new_loan'].T)
+    swapped = [total[:, None] - o + n[:, None] for total, o, n in zip(totals, old, new)]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        scores = calculator.score_from_sums(*swapped)
+    scores = np.where(np.isnan(scores), -np.inf, scores)
+    slots = np.argmax(scores, axis=1)
+    improves = scores[np.arange(slots.size), slots] > obs['score']
+    return np.where(improves, slots, REJECT)
@@ -0,0 +1,59 @@
+# encoding: utf-8
+
+# (c) 2014-2024 Open Risk, all rights reserved
+#
+# FuriousBanker is licensed under the MIT license a copy of which is included
+# in the source distribution of FuriousBanker. This is notwithstanding any licenses of
+# third-party software included in this distribution. You may not use this file except in
+# compliance with the License.
+#
+# Unless required by applicable law or agreed to in writing, software distributed under
+# the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND,
+# either express or implied. See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import json
+import os
+import sys
+import time
+
+# startup profiling is switched on with FURIOUSBANKER_PROFILE_STARTUP=1, any other
+# non empty value is taken as the path of a JSON file the report is appended to
+PROFILE = os.environ.get('FURIOUSBANKER_PROFILE_STARTUP', '')
+
+# reference point of the report: the first import of this module
+STARTED = time.perf_counter()
+
+marks = []
+
+
+# record the end of a startup phase
+def mark(phase):
+    marks.append((phase, time.perf_counter()))
+
+
+# startup phases with their duration and the time since STARTED, in ms
+def phases():
+    result = []
+    previous = STARTED
+    for phase, t in marks:
+        result.append({'phase': phase, 'ms': 1000 * (t - previous), 'total_ms': 1000 * (t - STARTED)})
+        previous = t
+    return result
+
+
+# log the startup report and optionally append it to the profile file
+def report(log=None):
+    if not PROFILE:
+        return
+    entries = phases()
+    for entry in entries:
+        line = 'Startup: {phase:<12} {ms:9.1f} ms  (at {total_ms:9.1f} ms)'.format(**entry)
+        if log is None:
+            print(line, file=sys.stderr)
+        else:
+            log(line)
+    if PROFILE != '1':
+        with open(PROFILE, 'a') as f:
+            f.write(json.dumps({'created': time.strftime('%Y-%m-%dT%H:%M:%S'), 'phases': entries}) + '\n')
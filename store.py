@@ -0,0 +1,195 @@
+# encoding: utf-8
+
+# (c) 2014-2024 Open Risk, all rights reserved
+#
+# FuriousBanker is licensed under the MIT license a copy of which is included
+# in the source distribution of FuriousBanker. This is notwithstanding any licenses of
+# third-party software included in this distribution. You may not use this file except in
+# compliance with the License.
+#
+# Unless required by applicable law or agreed to in writing, software distributed under
+# the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND,
+# either express or implied. See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import queue
+import sqlite3
+import threading
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    id INTEGER PRIMARY KEY,
+    player TEXT NOT NULL,
+    finished REAL NOT NULL,
+    duration REAL,
+    score REAL,
+    profitability REAL,
+    concentration REAL,
+    exposure REAL,
+    won INTEGER NOT NULL,
+    proposals INTEGER,
+    accepted INTEGER,
+    best_score REAL
+);
+CREATE INDEX IF NOT EXISTS sessions_score ON sessions (score DESC);
+CREATE INDEX IF NOT EXISTS sessions_player ON sessions (player, finished);
+CREATE TABLE IF NOT EXISTS steps (
+    session INTEGER NOT NULL REFERENCES sessions (id),
+    step INTEGER NOT NULL,
+    score REAL,
+    profitability REAL,
+    concentration REAL,
+    exposure REAL,
+    PRIMARY KEY (session, step)
+) WITHOUT ROWID;
+"""
+
+SESSION_FIELDS = ('player', 'finished', 'duration', 'score', 'profitability', 'concentration', 'exposure', 'won',
+                  'proposals', 'accepted', 'best_score')
+STEP_FIELDS = ('score', 'profitability', 'concentration', 'exposure')
+
+_STOP = object()
+
+
+# SQLite store of finished sessions, their final metrics and per step trajectories
+#
+# all database work happens on one writer thread with one connection (in WAL
+# mode, so readers never block it): save() and query() only put a request on a
+# queue and return at once. Requests that queue up while a transaction commits
+# are written together in the next one, so many sessions finishing at the same
+# time cost a single commit. Queries run in order after the writes queued
+# before them and hand their result to a callback on the writer thread. Errors
+# of the writer thread are kept in error and passed to log(message) (if given).
+class SessionStore:
+
+    def __init__(self, path, batch=512, log=None):
+        self.path = path
+        self.batch = batch
+        self.log = log
+        self.error = None
+        self._queue = queue.Queue()
+        self._ready = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        self._ready.wait()
+        if self.error is not None:
+            raise self.error
+
+    def _connect(self):
+        connection = sqlite3.connect(self.path)
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('PRAGMA synchronous=NORMAL')
+        connection.executescript(SCHEMA)
+        return connection
+
+    # keep an error of the writer thread and log it
+    def _fail(self, message, e):
+        self.error = e
+        if self.log is not None:
+            self.log('Store: {}: {}'.format(message, e))
+
+    def _run(self):
+        try:
+            connection = self._connect()
+        except sqlite3.Error as e:
+            self.error = e
+            self._ready.set()
+            return
+        self._ready.set()
+        stop = False
+        while not stop:
+            requests = [self._queue.get()]
+            while len(requests) < self.batch:
+                try:
+                    requests.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            writes = [r for r in requests if r is not _STOP and r[0] == 'save']
+            if writes:
+                self._write(connection, writes)
+            for r in requests:
+                if r is _STOP:
+                    stop = True
+                elif r[0] == 'query':
+                    self._query(connection, *r[1:])
+            for _ in requests:
+                self._queue.task_done()
+        connection.close()
+
+    # write a batch in one transaction. If any session in it fails the batch
+    # is written again one session per transaction, so that a bad row only
+    # loses itself.
+    def _write(self, connection, writes):
+        try:
+            with connection:
+                for _, session, steps in writes:
+                    self._insert(connection, session, steps)
+            return
+        except Exception as e:
+            if len(writes) == 1:
+                self._fail('session not saved', e)
+                return
+        for _, session, steps in writes:
+            try:
+                with connection:
+                    self._insert(connection, session, steps)
+            except Exception as e:
+                self._fail('session not saved', e)
+
+    def _insert(self, connection, session, steps):
+        cursor = connection.execute(
+            'INSERT INTO sessions ({}) VALUES ({})'.format(
+                ', '.join(SESSION_FIELDS), ', '.join('?' * len(SESSION_FIELDS))),
+            [session.get(field) for field in SESSION_FIELDS])
+        if steps:
+            connection.executemany(
+                'INSERT INTO steps (session, step, {}) VALUES (?, ?, ?, ?, ?, ?)'.format(
+                    ', '.join(STEP_FIELDS)),
+                [(cursor.lastrowid, i, *map(float, step)) for i, step in enumerate(steps)])
+
+    # run a query and hand its result to the callback, an error in either is
+    # kept in error and must not stop the writer thread
+    def _query(self, connection, function, callback):
+        try:
+            result = function(connection)
+            if callback is not None:
+                callback(result)
+        except Exception as e:
+            self._fail('query failed', e)
+
+    # queue a finished session: a dict with the SESSION_FIELDS (player,
+    # finished and won are required) and optionally its trajectory as a list of
+    # (score, profitability, concentration, exposure) per step
+    def save(self, session, steps=None):
+        self._queue.put(('save', dict(session), list(steps or ())))
+
+    # run function(connection) on the writer thread after the queued writes
+    # and pass the result to callback
+    def query(self, function, callback=None):
+        self._queue.put(('query', function, callback))
+
+    # the best sessions as (player, score, finished) rows
+    def leaderboard(self, callback, limit=10):
+        self.query(lambda c: c.execute('SELECT player, score, finished FROM sessions ORDER BY score DESC LIMIT ?',
+                                       (limit,)).fetchall(), callback)
+
+    # the sessions of a player in order as (finished, score, won) rows
+    def progress(self, player, callback):
+        self.query(lambda c: c.execute('SELECT finished, score, won FROM sessions WHERE player = ? ORDER BY finished',
+                                       (player,)).fetchall(), callback)
+
+    # the per step metrics of a session as (score, profitability,
+    # concentration, exposure) rows
+    def trajectory(self, session_id, callback):
+        self.query(lambda c: c.execute('SELECT {} FROM steps WHERE session = ? ORDER BY step'.format(
+            ', '.join(STEP_FIELDS)), (session_id,)).fetchall(), callback)
+
+    # wait until everything queued so far is written (or queried)
+    def flush(self):
+        self._queue.join()
+
+    def close(self):
+        if self._thread.is_alive():
+            self._queue.put(_STOP)
+            self._thread.join()
@@ -0,0 +1,72 @@
+# encoding: utf-8
+
+# (c) 2014-2024 Open Risk, all rights reserved
+#
+# FuriousBanker is licensed under the MIT license a copy of which is included
+# in the source distribution of FuriousBanker. This is notwithstanding any licenses of
+# third-party software included in this distribution. You may not use this file except in
+# compliance with the License.
+#
+# Unless required by applicable law or agreed to in writing, software distributed under
+# the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND,
+# either express or implied. See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import calculator  # noqa: E402
+import loansource  # noqa: E402
+import solver  # noqa: E402
+
+
+# more than half of the pool has a zero margin, so the median M / E is 0
+def test_zero_margin_pool():
+    el = np.full(12, 0.05)
+    s = np.where(np.arange(12) < 4, 0.09, 0.05)
+    exp = np.linspace(0.2, 0.9, 12)
+    portfolio = calculator.Portfolio(el, s, exp)
+    proposals = np.array([[0.05], [0.05], [0.5]])
+    solution = solver.solve(portfolio, proposals)
+    assert solution.score >= calculator.score(portfolio)
+    assert solution.optimal
+
+
+# sessions where the best score before rounding displays less than greedy play,
+# with the time limit of the game over screen
+def test_best_displayed_score():
+    for seed in (4, 20, 58):
+        portfolio_rng, loan_rng = loansource.SessionSeeder(seed).next()
+        portfolio = calculator.init(12, portfolio_rng)
+        proposals = loansource.RandomLoanSource(loan_rng).draw(100)
+        solution = solver.solve(portfolio, proposals)
+        assert solution.score >= solver.play(portfolio, proposals, solver.greedy)[0]
+
+
+# a session the solver does not prove within a second: without a time limit
+# it finds the best score, with one it reports optimal False
+def test_time_limit():
+    portfolio_rng, loan_rng = loansource.SessionSeeder(24).next()
+    portfolio = calculator.init(12, portfolio_rng)
+    proposals = loansource.RandomLoanSource(loan_rng).draw(100)
+    assert not solver.solve(portfolio, proposals, time_limit=0.1).optimal
+    solution = solver.solve(portfolio, proposals, time_limit=None)
+    assert solution.optimal
+    assert solution.score == 922.8
+
+
+# the node budget stops the same session at the same subset on every run
+def test_node_budget():
+    portfolio_rng, loan_rng = loansource.SessionSeeder(24).next()
+    portfolio = calculator.init(12, portfolio_rng)
+    proposals = loansource.RandomLoanSource(loan_rng).draw(100)
+    first = solver.solve(portfolio, proposals, time_limit=None, nodes=50)
+    second = solver.solve(portfolio, proposals, time_limit=None, nodes=50)
+    assert not first.optimal
+    assert first.score == second.score
+    assert np.array_equal(first.chosen, second.chosen)
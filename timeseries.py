@@ -0,0 +1,84 @@
+# encoding: utf-8
+
+# (c) 2014-2024 Open Risk, all rights reserved
+#
+# FuriousBanker is licensed under the MIT license a copy of which is included
+# in the source distribution of FuriousBanker. This is notwithstanding any licenses of
+# third-party software included in this distribution. You may not use this file except in
+# compliance with the License.
+#
+# Unless required by applicable law or agreed to in writing, software distributed under
+# the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND,
+# either express or implied. See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import numpy as np
+
+# the values recorded per row: the session time, the deals used up and the metrics
+FIELDS = ('time', 'deal', 'score', 'profitability', 'concentration', 'exposure')
+
+
+# fixed memory history of the game metrics: a (capacity, fields) array used as
+# a ring buffer, once it is full every new row overwrites the oldest one
+class MetricHistory:
+
+    def __init__(self, capacity=4096):
+        self.capacity = capacity
+        self.data = np.full((capacity, len(FIELDS)), np.nan)
+        self.count = 0
+
+    def append(self, time, deal, score, profitability, concentration, exposure):
+        self.data[self.count % self.capacity] = (time, deal, score, profitability, concentration, exposure)
+        self.count += 1
+
+    def clear(self):
+        self.count = 0
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    # the rows in order, oldest first (a copy)
+    def array(self):
+        if self.count <= self.capacity:
+            return self.data[:self.count].copy()
+        start = self.count % self.capacity
+        return np.concatenate([self.data[start:], self.data[:start]])
+
+    # one field of the rows in order, oldest first (a copy)
+    def column(self, name):
+        i = FIELDS.index(name)
+        if self.count <= self.capacity:
+            return self.data[:self.count, i].copy()
+        start = self.count % self.capacity
+        return np.concatenate([self.data[start:, i], self.data[:start, i]])
+
+    # write all rows to a CSV file (or a .npy file), with a header of the fields
+    def export(self, path):
+        export(path, self.array())
+
+
+# write rows of the fields to a CSV file (or a .npy file)
+def export(path, rows):
+    if path.endswith('.npy'):
+        np.save(path, rows)
+    else:
+        np.savetxt(path, rows, delimiter=',', header=','.join(FIELDS), comments='', fmt='%.6g')
+
+
+# min / max downsampling of the series (x, y) to at most 2 * buckets points:
+# the points are split into buckets of consecutive points and the lowest and
+# highest point of every bucket are kept in their order, so a line through the
+# result covers the same vertical range at every horizontal position
+def minmax(x, y, buckets):
+    n = y.size
+    if n <= 2 * buckets:
+        return x, y
+    size = -(-n // buckets)
+    # pad with the last point, which changes no bucket minimum or maximum
+    padded = np.concatenate([y, np.full(size * buckets - n, y[-1])]).reshape(buckets, size)
+    offsets = np.arange(buckets) * size
+    low = offsets + np.argmin(padded, axis=1)
+    high = offsets + np.argmax(padded, axis=1)
+    index = np.minimum(np.stack([np.minimum(low, high), np.maximum(low, high)], axis=1).ravel(), n - 1)
+    return x[index], y[index]